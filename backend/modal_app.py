@@ -3,27 +3,35 @@ Production-ready PDF extraction service using Modal.com
 Provides advanced PDF processing with multiple AI models
 """
 import modal
-import io
-import json
 import asyncio
+import atexit
+import multiprocessing
+import threading
+import time
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 import tempfile
 import os
+import hashlib
+import hmac
+import secrets
 from pathlib import Path
+from itertools import repeat
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse, Response
+from fastapi import FastAPI, File, Form, Header, Query, UploadFile, HTTPException
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 import fitz  # PyMuPDF
-import pandas as pd
-from PIL import Image, ImageDraw
+import aiofiles
 
 # Modal configuration
 app = modal.App("pdf-extraction-prod")
 
-# Define image with all dependencies
+# Define image with only what this module imports; the ML pipelines under
+# models/ are not served from here, so their heavy dependencies stay out
 image = (
     modal.Image.debian_slim(python_version="3.11")
     .pip_install([
@@ -31,14 +39,11 @@ image = (
         "uvicorn",
         "python-multipart",
         "PyMuPDF",
-        "Pillow",
-        "pandas",
         "pydantic",
         "numpy",
-        "requests",
         "aiofiles",
+        "orjson",
     ])
-    .apt_install(["poppler-utils", "tesseract-ocr", "tesseract-ocr-eng"])
 )
 
 # Persistent storage for uploaded files
@@ -57,6 +62,8 @@ class ExtractionRequest(BaseModel):
     models: List[str]
     options: Dict[str, Any] = {}
 
+# Built with model_construct() on the extraction hot path: every field comes
+# straight from PyMuPDF with the right type, so per-element validation is skipped
 class ElementInfo(BaseModel):
     type: str
     content: str
@@ -70,6 +77,18 @@ class ExtractionResult(BaseModel):
     metadata: Dict[str, Any]
     processing_time: float
     model: str
+    
+    # Elements bucketed by page, built on first lookup; private, so never serialized
+    _elements_by_page: Optional[Dict[int, List[ElementInfo]]] = PrivateAttr(default=None)
+    
+    def elements_on_page(self, page: int) -> List[ElementInfo]:
+        """Get the elements on a 1-based page without rescanning every element"""
+        if self._elements_by_page is None:
+            by_page = defaultdict(list)
+            for element in self.elements:
+                by_page[element.page].append(element)
+            self._elements_by_page = dict(by_page)
+        return self._elements_by_page.get(page, [])
 
 class ExtractResponse(BaseModel):
     upload_id: str
@@ -85,8 +104,8 @@ class ModelInfo(BaseModel):
     recommended_for: List[str]
     available: bool
 
-# FastAPI app
-web_app = FastAPI(title="PDF Extraction API", version="1.0.0")
+# FastAPI app; orjson keeps large /extract payloads (thousands of bbox floats) cheap to encode
+web_app = FastAPI(title="PDF Extraction API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS middleware
 web_app.add_middleware(
@@ -137,54 +156,253 @@ AVAILABLE_MODELS = {
     )
 }
 
-def extract_text_with_positions(pdf_path: str, model: str = "pymupdf_basic") -> ExtractionResult:
-    """Extract text with positional information using PyMuPDF"""
-    start_time = datetime.now()
+# Annotation colours per element type, as RGB tuples rather than colour names
+ELEMENT_COLORS: Dict[str, Tuple[int, int, int]] = {
+    "text": (0, 0, 255),       # blue
+    "table": (0, 128, 0),      # green
+    "image": (255, 0, 0),      # red
+    "heading": (128, 0, 128),  # purple
+}
+DEFAULT_ELEMENT_COLOR: Tuple[int, int, int] = (255, 165, 0)  # orange
+
+# Render scale for annotated page images (2x is 144 DPI); callers pick one of a fixed
+# set, which also bounds how many cached renders a page can have
+DEFAULT_ANNOTATION_ZOOM = 2.0
+ANNOTATION_ZOOMS = (1.0, 1.5, 2.0, 3.0, 4.0)
+
+# Annotated pages are cached on the volume, least recently used evicted first once the
+# cache passes ANNOTATION_CACHE_MAX_BYTES. Bump ANNOTATION_CACHE_VERSION whenever
+# extraction or drawing changes what a page looks like; the key also covers the colours
+# and the PyMuPDF version, so a new deploy never serves an older deploy's renders
+ANNOTATION_CACHE_DIR = "/mnt/storage/annotated"
+ANNOTATION_CACHE_MAX_BYTES = 512 << 20  # 512 MB
+ANNOTATION_CACHE_VERSION = 1
+ANNOTATION_RENDER_KEY = hashlib.sha1(
+    repr((ANNOTATION_CACHE_VERSION, ELEMENT_COLORS, DEFAULT_ELEMENT_COLOR, fitz.VersionBind)).encode()
+).hexdigest()[:12]
+
+# Uploads are streamed to the volume in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MB
+
+# Pages handed to each extraction worker; every task opens its own copy of the document
+PAGES_PER_TASK = 4
+
+# Resources reserved for the extraction function; os.cpu_count() reports the host's
+# cores, not this reservation, so the page pool is sized from it instead
+EXTRACT_CPU = 4.0
+EXTRACT_MEMORY_MB = 2048
+PAGE_POOL_WORKERS = max(1, min(int(EXTRACT_CPU), os.cpu_count() or 1))
+
+_page_pool: Optional[ProcessPoolExecutor] = None
+_page_pool_lock = threading.Lock()
+
+def get_page_pool() -> ProcessPoolExecutor:
+    """Get the shared process pool for per-page extraction, creating it on first use"""
+    global _page_pool
+    # Requests reach this from to_thread workers, so creation is locked
+    with _page_pool_lock:
+        if _page_pool is None:
+            # forkserver: forking the threaded server process directly can copy held locks
+            _page_pool = ProcessPoolExecutor(
+                max_workers=PAGE_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+            atexit.register(_page_pool.shutdown)
+    return _page_pool
+
+# Upper bound on model extractions running at once across /extract requests
+MAX_CONCURRENT_MODELS = 2
+_model_semaphore = asyncio.Semaphore(MAX_CONCURRENT_MODELS)
+
+# Recent extraction results keyed by (upload_id, model, sha256 of the stored PDF)
+RESULT_CACHE_SIZE = 64
+_result_cache: "OrderedDict[Tuple[str, str, str], ExtractionResult]" = OrderedDict()
+
+def get_cached_result(key: Tuple[str, str, str]) -> Optional[ExtractionResult]:
+    """Look up a cached extraction result, marking it as recently used"""
+    result = _result_cache.get(key)
+    if result is not None:
+        _result_cache.move_to_end(key)
+    return result
+
+def cache_result(key: Tuple[str, str, str], result: ExtractionResult):
+    """Store an extraction result, evicting the least recently used entry when full"""
+    _result_cache[key] = result
+    _result_cache.move_to_end(key)
+    if len(_result_cache) > RESULT_CACHE_SIZE:
+        _result_cache.popitem(last=False)
+
+# Document history lives in a Modal Dict so every replica reads and writes the same
+# state; one key per user holds that user's newest HISTORY_PAGE_SIZE entries, plus
+# the token the user's first save was issued, which later saves and reads must present
+history_store = modal.Dict.from_name("pdf-history", create_if_missing=True)
+HISTORY_PAGE_SIZE = 20
+
+# Serializes this container's read-modify-write of history records; saves for the
+# same user racing from two containers can still drop one entry
+_history_lock = asyncio.Lock()
+
+def check_history_token(record: Dict[str, Any], history_token: Optional[str]):
+    """Reject a request that doesn't carry the token issued for this user's history"""
+    if not history_token or not hmac.compare_digest(record["token"], history_token):
+        raise HTTPException(status_code=403, detail="Invalid history token")
+
+def count_pages(pdf_path: str) -> int:
+    """Get the page count of a stored PDF"""
+    doc = fitz.open(pdf_path)
+    page_count = len(doc)
+    doc.close()
+    return page_count
+
+def write_bytes_atomic(path: str, data: bytes):
+    """Write a file via a temporary sibling and rename, so readers never see a partial file"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def read_cached_image(path: str) -> Optional[bytes]:
+    """Read a cached render and mark it recently used, or None if it isn't cached"""
+    try:
+        img_bytes = Path(path).read_bytes()
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return img_bytes
+
+def store_cached_image(path: str, img_bytes: bytes):
+    """Cache a render, then evict the least recently used ones past ANNOTATION_CACHE_MAX_BYTES"""
+    os.makedirs(ANNOTATION_CACHE_DIR, exist_ok=True)
+    write_bytes_atomic(path, img_bytes)
+    
+    entries = []
+    total_size = 0
+    with os.scandir(ANNOTATION_CACHE_DIR) as it:
+        for entry in it:
+            # Skip other writers' in-progress temp files
+            if entry.name.endswith(".part"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+    
+    # Reads touch the mtime, so oldest mtime is least recently used
+    entries.sort()
+    for _, size, entry_path in entries:
+        if total_size <= ANNOTATION_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(entry_path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+def png_response(img_bytes: bytes, if_none_match: Optional[str]) -> Response:
+    """Serve a PNG with a content-hash ETag, or 304 when the client already has it"""
+    etag = f'"{hashlib.sha1(img_bytes).hexdigest()}"'
+    headers = {"Cache-Control": "max-age=3600", "ETag": etag}
+    
+    if if_none_match:
+        # Weak validators compare equal for a GET; "*" matches any current image
+        client_tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in client_tags or "*" in client_tags:
+            return Response(status_code=304, headers=headers)
+    
+    return Response(content=img_bytes, media_type="image/png", headers=headers)
+
+def open_pdf(pdf_path: str, pdf_bytes: Optional[bytes] = None) -> fitz.Document:
+    """Open a PDF from bytes already read for this request, or from disk"""
+    if pdf_bytes is not None:
+        return fitz.open(stream=pdf_bytes, filetype="pdf")
+    return fitz.open(pdf_path)
+
+def table_to_markdown(table: Any) -> str:
+    """Render a PyMuPDF table as a plain markdown pipe table straight from its extracted rows
+    
+    Same header names and cell contents as Table.to_pandas().to_markdown(), but without that
+    output's index column, column padding or alignment markers, so the text is not identical.
+    """
+    rows = table.extract()
+    header = table.header
+    
+    # Column names follow Table.to_pandas(): blank names become ColN, duplicates get an index prefix
+    headers = [name or f"Col{i}" for i, name in enumerate(header.names)]
+    if len(set(headers)) != len(headers):
+        headers = [name if name == f"Col{i}" else f"{i}-{name}" for i, name in enumerate(headers)]
+    
+    # The header row is part of the extracted rows unless it sits above the table
+    if not header.external:
+        rows = rows[1:]
+    
+    lines = [
+        "| " + " | ".join(headers) + " |",
+        "| " + " | ".join(["---"] * len(headers)) + " |",
+    ]
+    lines.extend(
+        "| " + " | ".join("" if cell is None else str(cell) for cell in row[:len(headers)]) + " |"
+        for row in rows
+    )
+    return "\n".join(lines)
+
+def extract_page_range(pdf_path: str, page_numbers: range, model: str, pdf_bytes: Optional[bytes] = None, doc: Optional[fitz.Document] = None) -> Tuple[List[ElementInfo], List[str], float, int]:
+    """Extract elements from a range of pages; runs in a worker process for multi-page PDFs"""
+    # Reuse the caller's open document when given; otherwise this call owns its own handle
+    owns_doc = doc is None
+    if owns_doc:
+        doc = open_pdf(pdf_path, pdf_bytes)
+    elements = []
+    full_text = []
+    
+    total_confidence = 0
+    element_count = 0
     
     try:
-        doc = fitz.open(pdf_path)
-        elements = []
-        full_text = []
-        
-        total_confidence = 0
-        element_count = 0
-        
-        for page_num in range(len(doc)):
+        for page_num in page_numbers:
             page = doc[page_num]
             
             if model == "pymupdf_advanced":
-                # Advanced extraction with tables and images
-                blocks = page.get_text("dict")
+                # Advanced extraction with tables and images; text-only flags keep
+                # PyMuPDF from copying image bytes into blocks we skip anyway
+                blocks = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)
                 
-                # Extract text blocks
-                for block in blocks["blocks"]:
-                    if "lines" in block:  # Text block
-                        block_text = ""
-                        bbox = block["bbox"]
-                        
-                        for line in block["lines"]:
-                            for span in line["spans"]:
-                                block_text += span["text"]
-                        
-                        if block_text.strip():
-                            elements.append(ElementInfo(
-                                type="text",
-                                content=block_text.strip(),
-                                bbox=list(bbox),
-                                page=page_num + 1,
-                                confidence=0.95
-                            ))
-                            full_text.append(block_text.strip())
-                            total_confidence += 0.95
-                            element_count += 1
+                # Extract text blocks (text blocks are the ones with "lines")
+                block_texts = [
+                    ("".join(span["text"] for line in block["lines"] for span in line["spans"]).strip(), block["bbox"])
+                    for block in blocks["blocks"]
+                    if "lines" in block
+                ]
+                page_elements = [
+                    ElementInfo.model_construct(
+                        type="text",
+                        content=block_text,
+                        bbox=list(bbox),
+                        page=page_num + 1,
+                        confidence=0.95
+                    )
+                    for block_text, bbox in block_texts
+                    if block_text
+                ]
                 
-                # Extract tables
-                tables = page.find_tables()
+                # Batch-append the page's text elements
+                elements.extend(page_elements)
+                full_text.extend(element.content for element in page_elements)
+                total_confidence += 0.95 * len(page_elements)
+                element_count += len(page_elements)
+                
+                # Extract tables; table detection works from ruling lines, so
+                # pages without any vector drawings can't contain one
+                tables = page.find_tables() if page.get_cdrawings() else []
                 for table in tables:
                     try:
-                        df = table.to_pandas()
-                        table_markdown = df.to_markdown(index=False)
-                        elements.append(ElementInfo(
+                        table_markdown = table_to_markdown(table)
+                        elements.append(ElementInfo.model_construct(
                             type="table",
                             content=table_markdown,
                             bbox=list(table.bbox),
@@ -197,52 +415,85 @@ def extract_text_with_positions(pdf_path: str, model: str = "pymupdf_basic") ->
                     except Exception as e:
                         print(f"Table extraction error: {e}")
                 
-                # Extract images
+                # Extract images; the element is a placeholder, so the image itself is never decoded
                 image_list = page.get_images()
-                for img_index, img in enumerate(image_list):
-                    try:
-                        xref = img[0]
-                        base_image = doc.extract_image(xref)
-                        elements.append(ElementInfo(
-                            type="image",
-                            content=f"[Image {img_index + 1} on page {page_num + 1}]",
-                            bbox=[0, 0, page.rect.width, page.rect.height],
-                            page=page_num + 1,
-                            confidence=0.90
-                        ))
-                        total_confidence += 0.90
-                        element_count += 1
-                    except Exception as e:
-                        print(f"Image extraction error: {e}")
+                for img_index, _ in enumerate(image_list):
+                    elements.append(ElementInfo.model_construct(
+                        type="image",
+                        content=f"[Image {img_index + 1} on page {page_num + 1}]",
+                        bbox=[0.0, 0.0, page.rect.width, page.rect.height],
+                        page=page_num + 1,
+                        confidence=0.90
+                    ))
+                    total_confidence += 0.90
+                    element_count += 1
             
             else:  # Basic extraction
                 text = page.get_text()
                 if text.strip():
-                    elements.append(ElementInfo(
+                    elements.append(ElementInfo.model_construct(
                         type="text",
                         content=text.strip(),
-                        bbox=[0, 0, page.rect.width, page.rect.height],
+                        bbox=[0.0, 0.0, page.rect.width, page.rect.height],
                         page=page_num + 1,
                         confidence=0.90
                     ))
                     full_text.append(text.strip())
                     total_confidence += 0.90
                     element_count += 1
+    finally:
+        if owns_doc:
+            doc.close()
+    
+    return elements, full_text, total_confidence, element_count
+
+def extract_text_with_positions(pdf_path: str, model: str = "pymupdf_basic", pdf_bytes: Optional[bytes] = None) -> ExtractionResult:
+    """Extract text with positional information using PyMuPDF"""
+    start_ns = time.perf_counter_ns()
+    
+    doc = None
+    try:
+        # Open once: the page count and single-range extraction share this handle
+        doc = open_pdf(pdf_path, pdf_bytes)
+        total_pages = len(doc)
         
-        doc.close()
+        page_ranges = [
+            range(start, min(start + PAGES_PER_TASK, total_pages))
+            for start in range(0, total_pages, PAGES_PER_TASK)
+        ]
+        
+        if len(page_ranges) > 1:
+            # Fan page ranges out to worker processes; map() keeps page order
+            chunks = get_page_pool().map(
+                extract_page_range, repeat(pdf_path), page_ranges, repeat(model)
+            )
+        else:
+            chunks = [extract_page_range(pdf_path, range(total_pages), model, doc=doc)]
+        
+        elements = []
+        full_text = []
+        
+        total_confidence = 0
+        element_count = 0
+        
+        for chunk_elements, chunk_text, chunk_confidence, chunk_count in chunks:
+            elements.extend(chunk_elements)
+            full_text.extend(chunk_text)
+            total_confidence += chunk_confidence
+            element_count += chunk_count
         
         # Generate markdown
         markdown_content = "\n\n".join(full_text)
         
         # Calculate metadata
-        processing_time = (datetime.now() - start_time).total_seconds()
+        processing_time = (time.perf_counter_ns() - start_ns) / 1e9
         avg_confidence = total_confidence / element_count if element_count > 0 else 0
         
         return ExtractionResult(
             markdown=markdown_content,
             elements=elements,
             metadata={
-                "total_pages": len(doc),
+                "total_pages": total_pages,
                 "total_elements": len(elements),
                 "confidence_avg": round(avg_confidence, 2),
                 "processing_time": round(processing_time, 2),
@@ -254,52 +505,43 @@ def extract_text_with_positions(pdf_path: str, model: str = "pymupdf_basic") ->
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Extraction failed: {str(e)}")
+    finally:
+        if doc is not None:
+            doc.close()
 
-def generate_annotated_image(pdf_path: str, page_num: int, elements: List[ElementInfo]) -> bytes:
+def generate_annotated_image(pdf_path: str, page_num: int, page_elements: List[ElementInfo], pdf_bytes: Optional[bytes] = None, zoom: float = DEFAULT_ANNOTATION_ZOOM) -> bytes:
     """Generate annotated image showing detected elements"""
     try:
-        doc = fitz.open(pdf_path)
+        doc = open_pdf(pdf_path, pdf_bytes)
         page = doc[page_num - 1]  # Convert to 0-based indexing
         
-        # Render page as image
-        mat = fitz.Matrix(2, 2)  # 2x zoom for better quality
-        pix = page.get_pixmap(matrix=mat)
-        img_data = pix.tobytes("png")
-        
-        # Open with PIL
-        img = Image.open(io.BytesIO(img_data))
-        draw = ImageDraw.Draw(img)
-        
-        # Draw bounding boxes for elements on this page
-        page_elements = [e for e in elements if e.page == page_num]
-        
-        colors = {
-            "text": "blue",
-            "table": "green", 
-            "image": "red",
-            "heading": "purple"
-        }
-        
+        # Draw bounding boxes for elements on this page straight onto the PDF page;
+        # the document is a private in-memory copy, so nothing is written back.
+        # Page coordinates are used as-is (the zoom is applied when rasterising)
         for element in page_elements:
             bbox = element.bbox
-            # Scale bbox coordinates by zoom factor
-            scaled_bbox = [coord * 2 for coord in bbox]
-            color = colors.get(element.type, "orange")
+            color = ELEMENT_COLORS.get(element.type, DEFAULT_ELEMENT_COLOR)
+            fitz_color = tuple(channel / 255 for channel in color)
             
-            # Draw rectangle
-            draw.rectangle(scaled_bbox, outline=color, width=3)
+            # Draw rectangle (1.5pt is 3px at the default 2x zoom)
+            page.draw_rect(fitz.Rect(bbox), color=fitz_color, width=1.5)
             
             # Add label
-            draw.text((scaled_bbox[0], scaled_bbox[1] - 20), 
-                     f"{element.type} ({element.confidence:.2f})", 
-                     fill=color)
+            page.insert_text(
+                (bbox[0], bbox[1] - 4),
+                f"{element.type} ({element.confidence:.2f})",
+                fontsize=8,
+                color=fitz_color
+            )
+        
+        # Render the annotated page once, encoding straight to PNG
+        mat = fitz.Matrix(zoom, zoom)
+        pix = page.get_pixmap(matrix=mat)
+        img_bytes = pix.tobytes("png")
         
         doc.close()
         
-        # Convert back to bytes
-        output = io.BytesIO()
-        img.save(output, format="PNG")
-        return output.getvalue()
+        return img_bytes
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
@@ -311,31 +553,47 @@ async def upload_file(file: UploadFile = File(...)):
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
-    # Generate unique upload ID
-    upload_id = f"upload_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{hash(file.filename) % 10000}"
-    
+    temp_path = None
     try:
-        # Save file to volume
+        # Stream to a temporary file on the volume so peak memory doesn't grow with
+        # the PDF size, hashing as we go; the upload ID is derived from the content
+        fd, temp_path = tempfile.mkstemp(dir="/mnt/storage", suffix=".part")
+        os.close(fd)
+        
+        hasher = hashlib.sha256()
+        size = 0
+        async with aiofiles.open(temp_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                hasher.update(chunk)
+                await f.write(chunk)
+                size += len(chunk)
+        
+        upload_id = f"upload_{hasher.hexdigest()[:16]}"
         file_path = f"/mnt/storage/{upload_id}.pdf"
-        content = await file.read()
         
-        with open(file_path, "wb") as f:
-            f.write(content)
+        # Identical content was uploaded before: keep the stored copy so its
+        # cached extractions and annotated images are reused
+        if os.path.exists(file_path):
+            os.remove(temp_path)
+            status = "deduped"
+        else:
+            os.replace(temp_path, file_path)
+            status = "uploaded"
         
         # Get basic info
-        doc = fitz.open(file_path)
-        page_count = len(doc)
-        doc.close()
+        page_count = await asyncio.to_thread(count_pages, file_path)
         
         return UploadResponse(
             upload_id=upload_id,
             filename=file.filename,
-            size=len(content),
+            size=size,
             pages=page_count,
-            status="uploaded"
+            status=status
         )
         
     except Exception as e:
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 @web_app.post("/extract", response_model=ExtractResponse)
@@ -346,19 +604,35 @@ async def extract_content(request: ExtractionRequest):
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
     
-    results = {}
+    # Validate every requested model before starting any extraction
+    for model in request.models:
+        if model not in AVAILABLE_MODELS:
+            raise HTTPException(status_code=400, detail=f"Model {model} not available")
+        
+        if not AVAILABLE_MODELS[model].available:
+            raise HTTPException(status_code=400, detail=f"Model {model} not currently available")
     
     try:
-        for model in request.models:
-            if model not in AVAILABLE_MODELS:
-                raise HTTPException(status_code=400, detail=f"Model {model} not available")
-            
-            if not AVAILABLE_MODELS[model].available:
-                raise HTTPException(status_code=400, detail=f"Model {model} not currently available")
+        # Read the PDF once and share it across every requested model
+        pdf_bytes = await asyncio.to_thread(Path(file_path).read_bytes)
+        file_hash = hashlib.sha256(pdf_bytes).hexdigest()
+        
+        async def run_model(model: str) -> ExtractionResult:
+            # Same upload, model and content as an earlier request in this container
+            cache_key = (request.upload_id, model, file_hash)
+            result = get_cached_result(cache_key)
+            if result is not None:
+                return result
             
-            # Extract using the specified model
-            result = extract_text_with_positions(file_path, model)
-            results[model] = result
+            # Extraction is blocking PyMuPDF work, so run it off the event loop
+            async with _model_semaphore:
+                result = await asyncio.to_thread(extract_text_with_positions, file_path, model, pdf_bytes)
+            cache_result(cache_key, result)
+            return result
+        
+        # Run the models concurrently; the request takes roughly as long as the slowest one
+        results_list = await asyncio.gather(*(run_model(model) for model in request.models))
+        results = dict(zip(request.models, results_list))
         
         return ExtractResponse(
             upload_id=request.upload_id,
@@ -370,29 +644,118 @@ async def extract_content(request: ExtractionRequest):
         raise HTTPException(status_code=500, detail=f"Extraction failed: {str(e)}")
 
 @web_app.get("/annotated-image/{upload_id}/{model}/{page}")
-async def get_annotated_image(upload_id: str, model: str, page: int):
+async def get_annotated_image(
+    upload_id: str,
+    model: str,
+    page: int,
+    zoom: float = Query(DEFAULT_ANNOTATION_ZOOM),
+    if_none_match: Optional[str] = Header(None)
+):
     """Get annotated image showing detected elements"""
+    # Reject bad parameters before anything is rendered or cached under their names
+    if model not in AVAILABLE_MODELS:
+        raise HTTPException(status_code=400, detail=f"Model {model} not available")
+    if zoom not in ANNOTATION_ZOOMS:
+        raise HTTPException(status_code=400, detail=f"zoom must be one of {', '.join(f'{z:g}' for z in ANNOTATION_ZOOMS)}")
+    if page < 1:
+        raise HTTPException(status_code=400, detail="page must be 1 or greater")
+    
     file_path = f"/mnt/storage/{upload_id}.pdf"
     
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
     
+    # Serve a previously rendered image for this page straight from the volume, with
+    # the same content ETag a fresh render gets
+    cache_path = f"{ANNOTATION_CACHE_DIR}/{upload_id}_{model}_page{page}_x{zoom:g}_{ANNOTATION_RENDER_KEY}.png"
+    img_bytes = await asyncio.to_thread(read_cached_image, cache_path)
+    if img_bytes is not None:
+        return png_response(img_bytes, if_none_match)
+    
     try:
-        # Get extraction results first
-        result = extract_text_with_positions(file_path, model)
+        pdf_bytes = await asyncio.to_thread(Path(file_path).read_bytes)
+        
+        # Get extraction results first, reusing a previous /extract run when possible
+        cache_key = (upload_id, model, hashlib.sha256(pdf_bytes).hexdigest())
+        result = get_cached_result(cache_key)
+        if result is None:
+            result = await asyncio.to_thread(extract_text_with_positions, file_path, model, pdf_bytes)
+            cache_result(cache_key, result)
         
-        # Generate annotated image
-        img_bytes = generate_annotated_image(file_path, page, result.elements)
+        # Pages past the end are rejected here, so they never get a cache entry
+        if page > result.metadata["total_pages"]:
+            raise HTTPException(status_code=404, detail="Page not found")
         
-        return Response(
-            content=img_bytes,
-            media_type="image/png",
-            headers={"Cache-Control": "max-age=3600"}
+        # Generate annotated image off the event loop; rendering is blocking PyMuPDF work
+        img_bytes = await asyncio.to_thread(
+            generate_annotated_image, file_path, page, result.elements_on_page(page), pdf_bytes, zoom
         )
+        await asyncio.to_thread(store_cached_image, cache_path, img_bytes)
         
+        return png_response(img_bytes, if_none_match)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
 
+@web_app.post("/history/save")
+async def save_document_history(
+    filename: str = Form(...),
+    models: str = Form(...),
+    total_elements: int = Form(...),
+    total_pages: int = Form(...),
+    processing_time: float = Form(...),
+    user_id: str = Form(...),
+    x_history_token: Optional[str] = Header(None)
+):
+    """Append a processed document to a user's history; returns the user's history token"""
+    entry = {
+        "filename": filename,
+        "user_id": user_id,
+        "models": models.split(","),
+        "total_elements": total_elements,
+        "total_pages": total_pages,
+        "processing_time": processing_time,
+        "timestamp": datetime.now().isoformat()
+    }
+    
+    async with _history_lock:
+        try:
+            record = await history_store.get.aio(user_id)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to save history: {str(e)}")
+        
+        # The first save claims the user's history and is issued its token
+        if record is None:
+            record = {"token": secrets.token_urlsafe(32), "entries": []}
+        else:
+            check_history_token(record, x_history_token)
+        
+        record["entries"] = (record["entries"] + [entry])[-HISTORY_PAGE_SIZE:]
+        try:
+            await history_store.put.aio(user_id, record)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to save history: {str(e)}")
+    
+    return {"success": True, "history_token": record["token"]}
+
+@web_app.get("/history")
+async def get_document_history(
+    user_id: str = Query(...),
+    x_history_token: Optional[str] = Header(None)
+):
+    """Get a user's most recent history entries, newest first"""
+    try:
+        record = await history_store.get.aio(user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load history: {str(e)}")
+    
+    if record is None:
+        return []
+    check_history_token(record, x_history_token)
+    return list(reversed(record["entries"]))
+
 @web_app.get("/models")
 async def get_models():
     """Get available extraction models"""
@@ -408,6 +771,83 @@ async def health_check():
         "available_models": len([m for m in AVAILABLE_MODELS.values() if m.available])
     })
 
+# Per-endpoint ASGI apps, built once at import time so Modal only hands back
+# the prepared app instead of rebuilding routes and middleware
+def _create_endpoint_app() -> FastAPI:
+    """Create a FastAPI app with the shared CORS configuration"""
+    endpoint_app = FastAPI(default_response_class=ORJSONResponse)
+    
+    # Add CORS middleware
+    endpoint_app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Allows all origins
+        allow_credentials=True,
+        allow_methods=["*"],  # Allows all methods
+        allow_headers=["*"],  # Allows all headers
+    )
+    
+    return endpoint_app
+
+upload_app = _create_endpoint_app()
+
+@upload_app.post("/")
+async def upload_file_endpoint(file: UploadFile = File(...)):
+    return await upload_file(file)
+
+extract_app = _create_endpoint_app()
+
+@extract_app.post("/")
+async def extract_content_endpoint(request: ExtractionRequest):
+    return await extract_content(request)
+
+annotated_image_app = _create_endpoint_app()
+
+@annotated_image_app.get("/{upload_id}/{model}/{page}")
+async def get_annotated_image_endpoint(
+    upload_id: str,
+    model: str,
+    page: int,
+    zoom: float = Query(DEFAULT_ANNOTATION_ZOOM),
+    if_none_match: Optional[str] = Header(None)
+):
+    return await get_annotated_image(upload_id, model, page, zoom, if_none_match)
+
+history_app = _create_endpoint_app()
+
+# Same paths as on web_app, so a client only swaps the base URL
+@history_app.post("/history/save")
+async def save_document_history_endpoint(
+    filename: str = Form(...),
+    models: str = Form(...),
+    total_elements: int = Form(...),
+    total_pages: int = Form(...),
+    processing_time: float = Form(...),
+    user_id: str = Form(...),
+    x_history_token: Optional[str] = Header(None)
+):
+    return await save_document_history(
+        filename, models, total_elements, total_pages, processing_time, user_id, x_history_token
+    )
+
+@history_app.get("/history")
+async def get_document_history_endpoint(
+    user_id: str = Query(...),
+    x_history_token: Optional[str] = Header(None)
+):
+    return await get_document_history(user_id, x_history_token)
+
+models_app = _create_endpoint_app()
+
+@models_app.get("/")
+async def get_models_endpoint():
+    return await get_models()
+
+health_app = _create_endpoint_app()
+
+@health_app.get("/")
+async def health_check_endpoint():
+    return await health_check()
+
 # Modal web endpoints with proper FastAPI integration
 @app.function(
     image=image,
@@ -418,54 +858,19 @@ async def health_check():
 @modal.asgi_app()
 def upload_endpoint():
     """Handle file uploads"""
-    from fastapi import FastAPI, File, UploadFile
-    from fastapi.middleware.cors import CORSMiddleware
-    
-    app = FastAPI()
-    
-    # Add CORS middleware
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # Allows all origins
-        allow_credentials=True,
-        allow_methods=["*"],  # Allows all methods
-        allow_headers=["*"],  # Allows all headers
-    )
-    
-    @app.post("/")
-    async def upload_file_endpoint(file: UploadFile = File(...)):
-        return await upload_file(file)
-    
-    return app
+    return upload_app
 
 @app.function(
     image=image, 
     volumes={"/mnt/storage": storage},
     timeout=300,
-    memory=2048
+    memory=EXTRACT_MEMORY_MB,
+    cpu=EXTRACT_CPU
 )
 @modal.asgi_app()
 def extract_endpoint():
     """Handle content extraction"""
-    from fastapi import FastAPI
-    from fastapi.middleware.cors import CORSMiddleware
-    
-    app = FastAPI()
-    
-    # Add CORS middleware
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # Allows all origins
-        allow_credentials=True,
-        allow_methods=["*"],  # Allows all methods
-        allow_headers=["*"],  # Allows all headers
-    )
-    
-    @app.post("/")
-    async def extract_content_endpoint(request: ExtractionRequest):
-        return await extract_content(request)
-    
-    return app
+    return extract_app
 
 @app.function(
     image=image,
@@ -476,73 +881,25 @@ def extract_endpoint():
 @modal.asgi_app()
 def annotated_image_endpoint():
     """Handle annotated image requests"""
-    from fastapi import FastAPI
-    from fastapi.middleware.cors import CORSMiddleware
-    
-    app = FastAPI()
-    
-    # Add CORS middleware
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # Allows all origins
-        allow_credentials=True,
-        allow_methods=["*"],  # Allows all methods
-        allow_headers=["*"],  # Allows all headers
-    )
-    
-    @app.get("/{upload_id}/{model}/{page}")
-    async def get_annotated_image_endpoint(upload_id: str, model: str, page: int):
-        return await get_annotated_image(upload_id, model, page)
-    
-    return app
+    return annotated_image_app
+
+@app.function(image=image, timeout=30)
+@modal.asgi_app()
+def history_endpoint():
+    """Handle document history requests"""
+    return history_app
 
 @app.function(image=image, timeout=30)
 @modal.asgi_app()
 def models_endpoint():
     """Handle model list requests"""
-    from fastapi import FastAPI
-    from fastapi.middleware.cors import CORSMiddleware
-    
-    app = FastAPI()
-    
-    # Add CORS middleware
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # Allows all origins
-        allow_credentials=True,
-        allow_methods=["*"],  # Allows all methods
-        allow_headers=["*"],  # Allows all headers
-    )
-    
-    @app.get("/")
-    async def get_models_endpoint():
-        return await get_models()
-    
-    return app
+    return models_app
 
 @app.function(image=image, timeout=30)
 @modal.asgi_app()
 def health_endpoint():
     """Handle health check requests"""
-    from fastapi import FastAPI
-    from fastapi.middleware.cors import CORSMiddleware
-    
-    app = FastAPI()
-    
-    # Add CORS middleware
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],  # Allows all origins
-        allow_credentials=True,
-        allow_methods=["*"],  # Allows all methods
-        allow_headers=["*"],  # Allows all headers
-    )
-    
-    @app.get("/")
-    async def health_check_endpoint():
-        return await health_check()
-    
-    return app
+    return health_app
 
 if __name__ == "__main__":
     # For local development
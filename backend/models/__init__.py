@@ -3,12 +3,14 @@ Model pipeline package for PDF extraction
 """
 
 # Import all model pipelines
-from .docling_pipeline import process_with_docling
+from .docling_pipeline import process_with_docling, process_batch_with_docling
 from .surya_pipeline import process_with_surya  
-from .mineru_pipeline import process_with_mineru
+from .mineru_pipeline import process_with_mineru, stream_with_mineru
 
 __all__ = [
     'process_with_docling',
+    'process_batch_with_docling',
     'process_with_surya', 
-    'process_with_mineru'
+    'process_with_mineru',
+    'stream_with_mineru'
 ]
\ No newline at end of file
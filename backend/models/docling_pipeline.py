@@ -1,22 +1,84 @@
 """
 Docling PDF extraction pipeline
 IBM's advanced document understanding model for PDF processing
+
+Options:
+    markdown_only: skip building elements (and their metadata) when only the
+        markdown is needed; the result has an empty element list
 """
 
 import asyncio
+import copy
+import hashlib
+import os
+import shutil
 import fitz  # PyMuPDF for fallback
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 import logging
+from collections import Counter, OrderedDict
+
+from .page_pool import get_page_pool
 
 logger = logging.getLogger(__name__)
 
+# Leading words that mark a block as a section header
+_HEADER_PREFIXES = ('chapter', 'section', 'introduction', 'conclusion', 'abstract', 'summary')
+_HEADER_PREFIX_LEN = max(len(prefix) for prefix in _HEADER_PREFIXES)
+
+# Docling's converter loads its layout/table models on construction, so build it
+# once per process and share it; the lock stops concurrent requests double-loading
+_converter: Optional[Any] = None
+_init_lock = asyncio.Lock()
+
+# Set once the Docling import has failed; a missing package won't appear later,
+# so requests go straight to the fallback instead of retrying the import
+_docling_missing = False
+
+# Recent results keyed by (sha256 of the PDF, markdown_only), so resubmitted files skip conversion
+RESULT_CACHE_SIZE = 64
+
+# Element type for Docling item class names, by name fragment; first match wins
+_ELEMENT_TYPE_RULES = (
+    (('title', 'heading'), 'title'),
+    (('header',), 'header'),
+    (('table',), 'table'),
+    (('list',), 'list'),
+    (('figure', 'picture', 'image'), 'image'),
+)
+
+# Element type per Docling item class, filled in as classes are first seen
+_element_type_cache: Dict[type, str] = {}
+
+# Whether a Docling item class carries (confidence, page) attributes, filled in the same way
+_item_attributes_cache: Dict[type, Tuple[bool, bool]] = {}
+
 class DoclingPipeline:
     def __init__(self):
         self.model_name = "docling"
         self.initialized = False
+        self._cache: "OrderedDict[Tuple[str, bool], Dict[str, Any]]" = OrderedDict()
         
     async def initialize(self):
         """Initialize Docling model"""
+        global _converter
+        
+        if _docling_missing:
+            return
+        
+        async with _init_lock:
+            if _converter is not None:
+                self.converter = _converter
+                self.initialized = True
+                return
+            
+            self._build_converter()
+            if self.initialized:
+                _converter = self.converter
+    
+    def _build_converter(self):
+        """Import Docling and construct the document converter"""
+        global _docling_missing
+        
         try:
             # Try to import and initialize Docling
             from docling.document_converter import DocumentConverter
@@ -30,6 +92,34 @@ class DoclingPipeline:
             pipeline_options.do_table_structure = True
             pipeline_options.table_structure_options.do_cell_matching = True
             
+            # Run the layout/OCR/table models on the best available device and
+            # every core; DOCLING_DEVICE (auto/cpu/cuda/mps) and DOCLING_NUM_THREADS override
+            try:
+                from docling.datamodel.pipeline_options import AcceleratorOptions, AcceleratorDevice
+                
+                pipeline_options.accelerator_options = AcceleratorOptions(
+                    num_threads=int(os.environ.get("DOCLING_NUM_THREADS", os.cpu_count() or 4)),
+                    device=AcceleratorDevice(os.environ.get("DOCLING_DEVICE", "auto")),
+                )
+            except ImportError:
+                logger.warning("Docling accelerator options not available, using defaults")
+            
+            # DOCLING_OCR_ENGINE=tesseract swaps the default float EasyOCR stage for
+            # Tesseract's integer LSTM engine, which is much lighter on CPU-only hosts.
+            # The CLI engine only needs the tesseract binary on PATH (the tesseract-ocr
+            # system package, as pytesseract does), not the tesserocr bindings; without
+            # it every conversion would fail, so the default OCR is kept instead
+            if os.environ.get("DOCLING_OCR_ENGINE") == "tesseract":
+                if shutil.which("tesseract") is None:
+                    logger.warning("tesseract binary not found, using default Docling OCR")
+                else:
+                    try:
+                        from docling.datamodel.pipeline_options import TesseractCliOcrOptions
+                        
+                        pipeline_options.ocr_options = TesseractCliOcrOptions()
+                    except ImportError:
+                        logger.warning("Docling Tesseract OCR options not available, using default OCR")
+            
             self.converter = DocumentConverter(
                 format_options={
                     InputFormat.PDF: pipeline_options,
@@ -43,11 +133,65 @@ class DoclingPipeline:
         except ImportError as e:
             logger.warning(f"Docling not available, using fallback PyMuPDF: {e}")
             self.initialized = False
+            _docling_missing = True
         except Exception as e:
             logger.error(f"Failed to initialize Docling: {e}")
             self.initialized = False
     
     async def extract(self, file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Extract content from PDF using Docling, reusing the result for content seen before"""
+        try:
+            cache_key = await self._cache_key(file_path, options)
+        except OSError as e:
+            logger.error(f"Docling extraction failed: {e}")
+            return self._failed_result(e)
+        
+        cached = self._cached_result(cache_key)
+        if cached is not None:
+            return cached
+        
+        result = await self._extract_uncached(file_path, options)
+        self._store_result(cache_key, result)
+        return result
+    
+    async def _cache_key(self, file_path: str, options: Optional[Dict[str, Any]]) -> Tuple[str, bool]:
+        """Result cache key: the file's content hash plus the options that change the result"""
+        return (await asyncio.to_thread(self._file_hash, file_path), self._markdown_only(options))
+    
+    def _file_hash(self, file_path: str) -> str:
+        """SHA-256 of a file's contents"""
+        with open(file_path, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+    
+    def _cached_result(self, cache_key: Tuple[str, bool]) -> Optional[Dict[str, Any]]:
+        """A private copy of a cached result, so callers can't modify the cached one"""
+        cached = self._cache.get(cache_key)
+        if cached is None:
+            return None
+        self._cache.move_to_end(cache_key)
+        return copy.deepcopy(cached)
+    
+    def _store_result(self, cache_key: Tuple[str, bool], result: Dict[str, Any]):
+        """Cache a copy of a Docling result, evicting the least recently used one"""
+        # Only Docling output is worth keeping; a PyMuPDF fallback after a transient
+        # init or conversion failure would otherwise be served until it's evicted
+        if not result["success"] or result["metadata"].get("model_version") != "docling_v1.0":
+            return
+        self._cache[cache_key] = copy.deepcopy(result)
+        if len(self._cache) > RESULT_CACHE_SIZE:
+            self._cache.popitem(last=False)
+    
+    def _failed_result(self, error: Exception) -> Dict[str, Any]:
+        """Result returned when a PDF can't be extracted at all"""
+        return {
+            "markdown": "",
+            "elements": [],
+            "metadata": {"total_pages": 0, "total_elements": 0, "by_type": {}, "confidence_avg": 0},
+            "success": False,
+            "error": str(error)
+        }
+    
+    async def _extract_uncached(self, file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
         """Extract content from PDF using Docling"""
         if not self.initialized:
             await self.initialize()
@@ -57,38 +201,197 @@ class DoclingPipeline:
             return await self._fallback_extraction(file_path, options)
         
         try:
-            # Process with Docling
-            result = self.converter.convert(file_path)
+            # Process with Docling in a worker thread; conversion runs the layout
+            # and table models and would otherwise block the event loop
+            result = await asyncio.to_thread(self.converter.convert, file_path)
             
-            # Extract structured content
-            markdown_content = result.document.export_to_markdown()
+            # Build the elements and markdown off the event loop as well
+            return await asyncio.to_thread(self._build_result, result, self._markdown_only(options))
             
-            # Extract elements with bounding boxes
+        except Exception as e:
+            logger.error(f"Docling extraction failed: {e}")
+            # Fallback to PyMuPDF
+            return await self._fallback_extraction(file_path, options)
+    
+    async def extract_batch(self, file_paths: List[str], options: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Extract several PDFs in one Docling conversion run, skipping those already cached"""
+        results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+        pending: Dict[int, Tuple[str, bool]] = {}
+        
+        for i, path in enumerate(file_paths):
+            try:
+                cache_key = await self._cache_key(path, options)
+            except OSError as e:
+                logger.error(f"Docling extraction failed: {e}")
+                results[i] = self._failed_result(e)
+                continue
+            
+            results[i] = self._cached_result(cache_key)
+            if results[i] is None:
+                pending[i] = cache_key
+        
+        if pending:
+            converted = await self._extract_batch_uncached([file_paths[i] for i in pending], options)
+            for (i, cache_key), result in zip(pending.items(), converted):
+                self._store_result(cache_key, result)
+                results[i] = result
+        
+        return results
+    
+    async def _extract_batch_uncached(self, file_paths: List[str], options: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Extract several PDFs in one Docling conversion run"""
+        if not self.initialized:
+            await self.initialize()
+        
+        if not self.initialized:
+            return list(await asyncio.gather(*(self._fallback_extraction(path, options) for path in file_paths)))
+        
+        try:
+            # convert_all streams every document through the already-loaded models,
+            # instead of paying per-call setup for each file
+            results = await asyncio.to_thread(lambda: list(self.converter.convert_all(file_paths)))
+            markdown_only = self._markdown_only(options)
+            return [await asyncio.to_thread(self._build_result, result, markdown_only) for result in results]
+            
+        except Exception as e:
+            logger.error(f"Docling batch extraction failed: {e}")
+            # Retry file by file so one bad PDF doesn't fail the whole batch
+            return list(await asyncio.gather(*(self._extract_uncached(path, options) for path in file_paths)))
+    
+    def _markdown_only(self, options: Optional[Dict[str, Any]]) -> bool:
+        """Whether the caller asked for markdown without elements"""
+        return bool((options or {}).get("markdown_only"))
+    
+    def _build_result(self, result, markdown_only: bool = False) -> Dict[str, Any]:
+        """Turn a Docling conversion result into markdown, elements and metadata"""
+        # Extract structured content
+        markdown_content = result.document.export_to_markdown()
+        
+        if markdown_only:
+            return {
+                "markdown": markdown_content,
+                "elements": [],
+                "metadata": {
+                    "total_pages": len(result.document.pages) if hasattr(result.document, 'pages') else 1,
+                    "markdown_only": True,
+                    "model_version": "docling_v1.0"
+                },
+                "success": True
+            }
+        
+        # Extract elements with bounding boxes, tallying types and confidence as we go
+        elements = []
+        type_counts = Counter()
+        confidence_sum = 0.0
+        for item in result.document.body:
+            bbox = getattr(item, 'bbox', None)
+            if bbox:
+                element_type = self._get_element_type(item)
+                has_confidence, has_page = self._get_item_attributes(item)
+                confidence = item.confidence if has_confidence else 0.95
+                type_counts[element_type] += 1
+                confidence_sum += confidence
+                
+                elements.append({
+                    "id": f"element_{len(elements)}",
+                    "type": element_type,
+                    "content": str(item.text) if hasattr(item, 'text') else str(item),
+                    "bbox": {
+                        "x1": bbox.l,
+                        "y1": bbox.t,
+                        "x2": bbox.r,
+                        "y2": bbox.b,
+                        "page": item.page if has_page else 0
+                    },
+                    "confidence": confidence
+                })
+        
+        # Extract metadata
+        metadata = {
+            "total_pages": len(result.document.pages) if hasattr(result.document, 'pages') else 1,
+            "total_elements": len(elements),
+            "by_type": dict(type_counts),
+            "confidence_avg": confidence_sum / len(elements) if elements else 0.95,
+            "features_detected": ["text", "tables", "structure", "layout"],
+            "model_version": "docling_v1.0"
+        }
+        
+        return {
+            "markdown": markdown_content,
+            "elements": elements,
+            "metadata": metadata,
+            "success": True
+        }
+    
+    def _get_element_type(self, item) -> str:
+        """Determine element type from Docling item"""
+        item_class = type(item)
+        element_type = _element_type_cache.get(item_class)
+        if element_type is None:
+            element_type = self._element_type_for_name(item_class.__name__.lower())
+            _element_type_cache[item_class] = element_type
+        return element_type
+    
+    def _get_item_attributes(self, item) -> Tuple[bool, bool]:
+        """Check once per Docling item class whether it has confidence and page attributes"""
+        item_class = type(item)
+        attributes = _item_attributes_cache.get(item_class)
+        if attributes is None:
+            attributes = (hasattr(item, 'confidence'), hasattr(item, 'page'))
+            _item_attributes_cache[item_class] = attributes
+        return attributes
+    
+    def _element_type_for_name(self, item_type: str) -> str:
+        """Map a lowercased Docling item class name to an element type"""
+        for fragments, element_type in _ELEMENT_TYPE_RULES:
+            if any(fragment in item_type for fragment in fragments):
+                return element_type
+        return 'text'
+    
+    async def _fallback_extraction(self, file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Fallback extraction using PyMuPDF with enhanced processing"""
+        try:
+            page_count = await asyncio.to_thread(self._page_count, file_path)
+            markdown_only = self._markdown_only(options)
+            
+            # Pages are independent: fan them out to the shared process pool;
+            # gather() keeps the results in page order
+            loop = asyncio.get_running_loop()
+            # Fallback pages are parsed in worker processes: page parsing is mostly
+            # Python-level dict/str work, so threads would serialize on the GIL
+            pool = get_page_pool()
+            page_results = await asyncio.gather(*(
+                loop.run_in_executor(pool, _extract_page_worker, file_path, page_num, markdown_only)
+                for page_num in range(page_count)
+            ))
+            
+            markdown_content = "".join(page_markdown for page_markdown, _ in page_results)
+            
+            if markdown_only:
+                return {
+                    "markdown": markdown_content,
+                    "elements": [],
+                    "metadata": {"total_pages": page_count, "markdown_only": True},
+                    "success": True
+                }
+            
+            # Merge the pages' elements, tallying types and confidence in the same pass
             elements = []
-            for item in result.document.body:
-                if hasattr(item, 'bbox') and item.bbox:
-                    elements.append({
-                        "id": f"element_{len(elements)}",
-                        "type": self._get_element_type(item),
-                        "content": str(item.text) if hasattr(item, 'text') else str(item),
-                        "bbox": {
-                            "x1": item.bbox.l,
-                            "y1": item.bbox.t,
-                            "x2": item.bbox.r,
-                            "y2": item.bbox.b,
-                            "page": getattr(item, 'page', 0)
-                        },
-                        "confidence": getattr(item, 'confidence', 0.95)
-                    })
+            type_counts = Counter()
+            confidence_sum = 0.0
+            for _, page_elements in page_results:
+                for element in page_elements:
+                    type_counts[element["type"]] += 1
+                    confidence_sum += element["confidence"]
+                elements.extend(page_elements)
             
-            # Extract metadata
             metadata = {
-                "total_pages": len(result.document.pages) if hasattr(result.document, 'pages') else 1,
+                "total_pages": page_count,
                 "total_elements": len(elements),
-                "by_type": self._count_by_type(elements),
-                "confidence_avg": sum(e["confidence"] for e in elements) / len(elements) if elements else 0.95,
-                "features_detected": ["text", "tables", "structure", "layout"],
-                "model_version": "docling_v1.0"
+                "by_type": dict(type_counts),
+                "confidence_avg": confidence_sum / len(elements) if elements else 0.85,
+                "features_detected": ["text", "structure", "tables"],
+                "model_version": "pymupdf_fallback_v1.0"
             }
             
             return {
@@ -99,106 +402,84 @@ class DoclingPipeline:
             }
             
         except Exception as e:
-            logger.error(f"Docling extraction failed: {e}")
-            # Fallback to PyMuPDF
-            return await self._fallback_extraction(file_path, options)
-    
-    def _get_element_type(self, item) -> str:
-        """Determine element type from Docling item"""
-        item_type = type(item).__name__.lower()
-        
-        if 'title' in item_type or 'heading' in item_type:
-            return 'title'
-        elif 'header' in item_type:
-            return 'header'
-        elif 'table' in item_type:
-            return 'table'
-        elif 'list' in item_type:
-            return 'list'
-        elif 'figure' in item_type or 'image' in item_type:
-            return 'image'
-        else:
-            return 'text'
+            logger.error(f"Fallback extraction failed: {e}")
+            return self._failed_result(e)
     
-    def _count_by_type(self, elements: List[Dict]) -> Dict[str, int]:
-        """Count elements by type"""
-        counts = {}
-        for element in elements:
-            element_type = element["type"]
-            counts[element_type] = counts.get(element_type, 0) + 1
-        return counts
+    def _page_count(self, file_path: str) -> int:
+        """Get the number of pages in a PDF"""
+        doc = fitz.open(file_path)
+        try:
+            return len(doc)
+        finally:
+            doc.close()
     
-    async def _fallback_extraction(self, file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
-        """Fallback extraction using PyMuPDF with enhanced processing"""
+    def _extract_page(self, file_path: str, page_num: int, markdown_only: bool = False) -> Tuple[str, List[Dict[str, Any]]]:
+        """Extract markdown and elements from one page; opens its own document so pages can run in parallel"""
+        doc = fitz.open(file_path)
         try:
-            doc = fitz.open(file_path)
-            
-            markdown_content = ""
+            # Markdown pieces for the page, joined once at the end
+            page_parts = []
             elements = []
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
+            page = doc[page_num]
+            
+            # Extract text blocks with enhanced structure detection; only the block
+            # text and bbox are used, so the flat "blocks" output (lines already
+            # joined by MuPDF) replaces the per-span "dict" tree. Image blocks are
+            # kept (as short descriptions, not bytes) so block numbers, and the
+            # element ids built from them, match the full page structure
+            blocks = page.get_text("blocks", flags=fitz.TEXTFLAGS_TEXT | fitz.TEXT_PRESERVE_IMAGES)
+            page_parts.append(f"\n\n## Page {page_num + 1}\n\n")
+            
+            # Process blocks to identify structure
+            for x0, y0, x1, y1, block_text, block_no, block_type in blocks:
+                if block_type != 0:  # not a text block
+                    continue
                 
-                # Extract text blocks with enhanced structure detection
-                blocks = page.get_text("dict")
-                page_content = f"\n\n## Page {page_num + 1}\n\n"
+                # Strip once; the stripped text is what every consumer below uses
+                block_text = block_text.strip()
                 
-                # Process blocks to identify structure
-                for block_idx, block in enumerate(blocks["blocks"]):
-                    if "lines" not in block:
-                        continue
+                if block_text:
+                    # Determine element type based on formatting and position
+                    element_type = self._classify_block(block_text, (x0, y0, x1, y1), blocks)
                     
-                    block_text = ""
-                    block_bbox = block["bbox"]
-                    
-                    for line in block["lines"]:
-                        line_text = ""
-                        for span in line["spans"]:
-                            line_text += span["text"]
-                        
-                        if line_text.strip():
-                            block_text += line_text + "\n"
-                    
-                    if block_text.strip():
-                        # Determine element type based on formatting and position
-                        element_type = self._classify_block(block_text, block_bbox, blocks["blocks"])
-                        
+                    if not markdown_only:
                         elements.append({
-                            "id": f"page_{page_num}_block_{block_idx}",
+                            "id": f"page_{page_num}_block_{block_no}",
                             "type": element_type,
-                            "content": block_text.strip(),
+                            "content": block_text,
                             "bbox": {
-                                "x1": block_bbox[0],
-                                "y1": block_bbox[1],
-                                "x2": block_bbox[2],
-                                "y2": block_bbox[3],
+                                "x1": x0,
+                                "y1": y0,
+                                "x2": x1,
+                                "y2": y1,
                                 "page": page_num
                             },
                             "confidence": 0.85  # Lower confidence for fallback
                         })
-                        
-                        # Add to markdown with appropriate formatting
-                        if element_type == "title":
-                            page_content += f"# {block_text.strip()}\n\n"
-                        elif element_type == "header":
-                            page_content += f"## {block_text.strip()}\n\n"
-                        else:
-                            page_content += f"{block_text.strip()}\n\n"
-                
-                markdown_content += page_content
-                
-                # Extract tables using PyMuPDF's table detection
-                try:
-                    tables = page.find_tables()
-                    for table_idx, table in enumerate(tables):
-                        table_data = table.extract()
-                        if table_data:
-                            # Add table to elements
-                            table_bbox = table.bbox
+                    
+                    # Add to markdown with appropriate formatting
+                    if element_type == "title":
+                        page_parts.append(f"# {block_text}\n\n")
+                    elif element_type == "header":
+                        page_parts.append(f"## {block_text}\n\n")
+                    else:
+                        page_parts.append(f"{block_text}\n\n")
+            
+            # Extract tables using PyMuPDF's table detection
+            try:
+                tables = page.find_tables()
+                for table_idx, table in enumerate(tables):
+                    table_data = table.extract()
+                    if table_data:
+                        # Add table to elements
+                        table_bbox = table.bbox
+                        table_markdown = self._format_table_markdown(table_data)
+                        if not markdown_only:
                             elements.append({
                                 "id": f"page_{page_num}_table_{table_idx}",
                                 "type": "table",
-                                "content": self._format_table_markdown(table_data),
+                                "content": table_markdown,
                                 "bbox": {
                                     "x1": table_bbox[0],
                                     "y1": table_bbox[1],
@@ -208,102 +489,78 @@ class DoclingPipeline:
                                 },
                                 "confidence": 0.80
                             })
-                            
-                            # Add table to markdown
-                            markdown_content += f"\n{self._format_table_markdown(table_data)}\n\n"
-                except:
-                    pass  # Table extraction is optional
-                
-                # Extract images from the page
-                try:
-                    image_list = page.get_images(full=True)
-                    for img_idx, img in enumerate(image_list):
-                        # Get image info
-                        xref = img[0]
-                        pix = fitz.Pixmap(doc, xref)
-                        
-                        # Skip very small images (likely decorative)
-                        if pix.width < 50 or pix.height < 50:
-                            pix = None
-                            continue
-                        
-                        # Get image bbox - estimate from page content if not available
-                        img_bbox = self._estimate_image_bbox(page, xref, pix)
-                        
-                        # Create image element
-                        image_element = {
-                            "id": f"page_{page_num}_image_{img_idx}",
-                            "type": "image",
-                            "content": f"[Image: {pix.width}x{pix.height} pixels]",
-                            "bbox": {
-                                "x1": img_bbox[0],
-                                "y1": img_bbox[1],
-                                "x2": img_bbox[2],
-                                "y2": img_bbox[3],
-                                "page": page_num
-                            },
-                            "confidence": 0.90,
-                            "image_info": {
-                                "width": pix.width,
-                                "height": pix.height,
-                                "colorspace": pix.colorspace.name if pix.colorspace else "Unknown",
-                                "xref": xref,
-                                "size_bytes": len(pix.tobytes())
-                            }
-                        }
-                        
-                        elements.append(image_element)
                         
-                        # Add image to markdown
-                        page_content += f"\n![Image {img_idx + 1}](image_{page_num}_{img_idx}.png)\n"
-                        page_content += f"*Image: {pix.width}x{pix.height} pixels*\n\n"
-                        
-                        # Clean up pixmap
-                        pix = None
-                        
-                except Exception as e:
-                    logger.warning(f"Image extraction failed for page {page_num}: {e}")
-                    pass
+                        # Add table to markdown
+                        page_parts.append(f"\n{table_markdown}\n\n")
+            except:
+                pass  # Table extraction is optional
             
-            doc.close()
+            # Images only contribute elements, so markdown-only callers can stop here
+            if markdown_only:
+                return "".join(page_parts), elements
             
-            metadata = {
-                "total_pages": len(doc),
-                "total_elements": len(elements),
-                "by_type": self._count_by_type(elements),
-                "confidence_avg": sum(e["confidence"] for e in elements) / len(elements) if elements else 0.85,
-                "features_detected": ["text", "structure", "tables"],
-                "model_version": "pymupdf_fallback_v1.0"
-            }
+            # Extract images from the page
+            try:
+                image_list = page.get_images(full=True)
+                for img_idx, img in enumerate(image_list):
+                    # Get image info
+                    xref = img[0]
+                    pix = fitz.Pixmap(doc, xref)
+                    
+                    # Skip very small images (likely decorative)
+                    if pix.width < 50 or pix.height < 50:
+                        pix = None
+                        continue
+                    
+                    # Get image bbox - estimate from page content if not available
+                    img_bbox = self._estimate_image_bbox(page, xref, pix)
+                    
+                    # Create image element
+                    image_element = {
+                        "id": f"page_{page_num}_image_{img_idx}",
+                        "type": "image",
+                        "content": f"[Image: {pix.width}x{pix.height} pixels]",
+                        "bbox": {
+                            "x1": img_bbox[0],
+                            "y1": img_bbox[1],
+                            "x2": img_bbox[2],
+                            "y2": img_bbox[3],
+                            "page": page_num
+                        },
+                        "confidence": 0.90,
+                        "image_info": {
+                            "width": pix.width,
+                            "height": pix.height,
+                            "colorspace": pix.colorspace.name if pix.colorspace else "Unknown",
+                            "xref": xref,
+                            "size_bytes": len(pix.tobytes())
+                        }
+                    }
+                    
+                    elements.append(image_element)
+                    
+                    # Clean up pixmap
+                    pix = None
             
-            return {
-                "markdown": markdown_content,
-                "elements": elements,
-                "metadata": metadata,
-                "success": True
-            }
+            except Exception as e:
+                logger.warning(f"Image extraction failed for page {page_num}: {e}")
+                pass
             
-        except Exception as e:
-            logger.error(f"Fallback extraction failed: {e}")
-            return {
-                "markdown": "",
-                "elements": [],
-                "metadata": {"total_pages": 0, "total_elements": 0, "by_type": {}, "confidence_avg": 0},
-                "success": False,
-                "error": str(e)
-            }
+            return "".join(page_parts), elements
+        finally:
+            doc.close()
     
-    def _classify_block(self, text: str, bbox: List[float], all_blocks: List[Dict]) -> str:
+    def _classify_block(self, text: str, bbox: List[float], all_blocks: List[tuple]) -> str:
         """Classify text block based on content and formatting"""
-        text_lower = text.lower().strip()
+        text = text.strip()
         
         # Check if it's likely a title (short, at top, larger than average)
-        if len(text_lower) < 100 and bbox[1] < 200:  # Near top of page
+        if len(text) < 100 and bbox[1] < 200:  # Near top of page
             return "title"
         
-        # Check for common header patterns
-        if (text_lower.startswith(('chapter', 'section', 'introduction', 'conclusion', 'abstract', 'summary')) or
-            len(text_lower) < 50):
+        # Check for common header patterns (cheap length test first); only the
+        # leading characters can match a prefix, so only they are lowercased
+        if len(text) < 50 or text[:_HEADER_PREFIX_LEN].lower().startswith(_HEADER_PREFIXES):
             return "header"
         
         # Default to text
@@ -314,19 +571,17 @@ class DoclingPipeline:
         if not table_data or not table_data[0]:
             return ""
         
-        markdown = ""
-        
         # Header row
         headers = table_data[0]
-        markdown += "| " + " | ".join(headers) + " |\n"
-        markdown += "| " + " | ".join(["---"] * len(headers)) + " |\n"
+        lines = [
+            "| " + " | ".join(headers) + " |\n",
+            "| " + " | ".join(["---"] * len(headers)) + " |\n",
+        ]
         
         # Data rows
-        for row in table_data[1:]:
-            if len(row) == len(headers):
-                markdown += "| " + " | ".join(row) + " |\n"
+        lines.extend("| " + " | ".join(row) + " |\n" for row in table_data[1:] if len(row) == len(headers))
         
-        return markdown
+        return "".join(lines)
     
     def _estimate_image_bbox(self, page, xref: int, pix) -> List[float]:
         """Estimate image bounding box on the page"""
@@ -360,6 +615,16 @@ class DoclingPipeline:
 docling_pipeline = DoclingPipeline()
 
 
+def _extract_page_worker(file_path: str, page_num: int, markdown_only: bool) -> Tuple[str, List[Dict[str, Any]]]:
+    """Process-pool entry point for fallback page extraction (module-level so it pickles)"""
+    return docling_pipeline._extract_page(file_path, page_num, markdown_only)
+
+
 async def process_with_docling(file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
     """Process PDF with Docling pipeline"""
-    return await docling_pipeline.extract(file_path, options)
\ No newline at end of file
+    return await docling_pipeline.extract(file_path, options)
+
+
+async def process_batch_with_docling(file_paths: List[str], options: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    """Process several PDFs with Docling pipeline"""
+    return await docling_pipeline.extract_batch(file_paths, options)
\ No newline at end of file
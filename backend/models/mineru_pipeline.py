@@ -5,13 +5,207 @@ Optimized for academic papers, formulas, citations, and scientific content
 
 import asyncio
 import fitz  # PyMuPDF for fallback
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, AsyncIterator, Optional, Tuple
 import logging
+from collections import Counter, deque
 import re
 import json
+import threading
+
+from .page_pool import PAGE_POOL_WORKERS, get_page_pool
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None  # Optional; the precompiled re patterns are used instead
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None  # Optional; keyword checks fall back to substring search
 
 logger = logging.getLogger(__name__)
 
+# Block classification patterns, compiled once at import
+_FORMULA_PATTERNS = tuple(re.compile(p) for p in (
+    r'\$.*?\$',  # LaTeX inline math
+    r'\$\$.*?\$\$',  # LaTeX display math
+    r'\\[a-zA-Z]+\{.*?\}',  # LaTeX commands
+    r'[∑∏∫∂∇∞±≤≥≠≈∝∈∉⊂⊃∪∩]',  # Mathematical symbols
+    r'[α-ωΑ-Ω]',  # Greek letters
+    r'\b\d+\s*[+\-*/=]\s*\d+',  # Basic equations
+    r'\b[a-zA-Z]\s*=\s*[^,;.]+',  # Variable assignments
+))
+
+# Citation patterns are all lowercase and run case-sensitively against lowercased text,
+# which keeps the regex engine off its slower case-insensitive path
+_CITATION_PATTERNS = tuple(re.compile(p) for p in (
+    r'\[[\d\s,\-]+\]',  # [1], [1,2], [1-3]
+    r'\([^)]*\d{4}[^)]*\)',  # (Author, 2021)
+    r'et al\.',  # "et al."
+    r'ibid\.',  # "ibid."
+    r'op\. cit\.',  # "op. cit."
+))
+
+# Each group fused into one alternation, so a block is scanned once per group
+_FORMULA_RE = re.compile("|".join(f"(?:{p.pattern})" for p in _FORMULA_PATTERNS))
+_CITATION_RE = re.compile("|".join(f"(?:{p.pattern})" for p in _CITATION_PATTERNS))
+
+# Characters every pattern in a group needs at least one of; a single character-class
+# scan rules out most plain prose before the full alternation runs
+_FORMULA_PREFILTER_RE = re.compile(r'[$\\=\d∑∏∫∂∇∞±≤≥≠≈∝∈∉⊂⊃∪∩α-ωΑ-Ω]')
+_CITATION_PREFILTER_RE = re.compile(r'[\[(.]')
+
+# Patterns used when extracting details from classified blocks
+_LATEX_RE = re.compile(r'\$\$?(.*?)\$\$?')
+_BRACKET_REFS_RE = re.compile(r'\[([\d\s,\-]+)\]')
+_AUTHOR_YEAR_RE = re.compile(r'\(([^)]*\d{4}[^)]*)\)')
+_NUMBERED_SECTION_RE = re.compile(r'^\d+\.?\s+[A-Z]')
+
+# Unicode math symbols and their LaTeX equivalents, as a str.translate table
+_SYMBOL_MAP = str.maketrans({
+    '±': r'\pm',
+    '≤': r'\leq',
+    '≥': r'\geq',
+    '≠': r'\neq',
+    '≈': r'\approx',
+    '∝': r'\propto',
+    '∈': r'\in',
+    '∉': r'\notin',
+    '⊂': r'\subset',
+    '⊃': r'\supset',
+    '∪': r'\cup',
+    '∩': r'\cap',
+    '∑': r'\sum',
+    '∏': r'\prod',
+    '∫': r'\int',
+    '∂': r'\partial',
+    '∇': r'\nabla',
+    '∞': r'\infty',
+})
+
+# Academic section keywords; the set catches bare headers and the regex
+# matches a keyword anywhere in the block
+_ACADEMIC_SECTIONS = frozenset({
+    'abstract', 'introduction', 'methodology', 'methods', 'results',
+    'discussion', 'conclusion', 'acknowledgments', 'references',
+    'bibliography', 'appendix', 'related work', 'background',
+    'literature review', 'experimental setup', 'evaluation',
+    'future work', 'limitations'
+})
+_ACADEMIC_SECTION_RE = re.compile("|".join(re.escape(section) for section in sorted(_ACADEMIC_SECTIONS)))
+
+# Section keyword -> section type, in lookup priority order
+_SECTION_TYPE_MAP = {
+    'abstract': 'abstract',
+    'introduction': 'introduction',
+    'methodology': 'methods',
+    'methods': 'methods',
+    'results': 'results',
+    'discussion': 'discussion',
+    'conclusion': 'conclusion',
+    'acknowledgments': 'acknowledgments',
+    'references': 'references',
+    'bibliography': 'references',
+    'appendix': 'appendix'
+}
+
+# Header keywords per scientific table type, in classification priority order
+_TABLE_TYPE_KEYWORDS = (
+    ("results", ('result', 'data', 'value', 'measurement', 'experiment')),
+    ("statistics", ('mean', 'std', 'p-value', 'significance', 'correlation')),
+    ("comparison", ('method', 'approach', 'algorithm', 'model', 'comparison')),
+    ("parameters", ('parameter', 'setting', 'configuration', 'hyperparameter')),
+)
+
+# Hyperscan match ids for the combined block scan
+_FORMULA_ID = 1
+_CITATION_ID = 2
+
+
+def _hyperscan_pattern(patterns) -> bytes:
+    """Join re patterns into one Hyperscan expression that matches the same texts"""
+    # Hyperscan has no \b in UCP mode. Every \b here comes before a word character,
+    # so for "is there a match" it means "at the start or after a non-word character"
+    return "|".join(p.pattern.replace(r"\b", r"(?:^|\W)") for p in patterns).encode("utf-8")
+
+
+def _build_scientific_db():
+    """Compile the formula and citation patterns into one Hyperscan database"""
+    if hyperscan is None:
+        return None
+    
+    try:
+        # UCP gives \d, \s and \w the same Unicode meaning they have in re, so a
+        # block is classified the same with or without Hyperscan installed
+        flags = hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_SINGLEMATCH
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[
+                _hyperscan_pattern(_FORMULA_PATTERNS),
+                _hyperscan_pattern(_CITATION_PATTERNS),
+            ],
+            ids=[_FORMULA_ID, _CITATION_ID],
+            elements=2,
+            flags=[flags, flags | hyperscan.HS_FLAG_CASELESS],
+        )
+        return db
+    except Exception as e:
+        logger.warning(f"Hyperscan compilation failed, using re patterns: {e}")
+        return None
+
+
+_SCIENTIFIC_DB = _build_scientific_db()
+
+
+def _build_keyword_automaton(keywords):
+    """Build an Aho-Corasick automaton from (keyword, value) pairs, or None without pyahocorasick"""
+    if ahocorasick is None:
+        return None
+    
+    automaton = ahocorasick.Automaton()
+    for keyword, value in keywords:
+        automaton.add_word(keyword, value)
+    automaton.make_automaton()
+    return automaton
+
+
+# Keyword automatons: one pass over the text finds every keyword it contains.
+# Values carry the keyword's priority so the first-listed match still wins.
+_ACADEMIC_SECTION_AC = _build_keyword_automaton((section, section) for section in _ACADEMIC_SECTIONS)
+_SECTION_TYPE_AC = _build_keyword_automaton(
+    (keyword, (priority, section_type))
+    for priority, (keyword, section_type) in enumerate(_SECTION_TYPE_MAP.items())
+)
+_TABLE_TYPE_AC = _build_keyword_automaton(
+    (word, priority)
+    for priority, (_, words) in enumerate(_TABLE_TYPE_KEYWORDS)
+    for word in words
+)
+
+# Hyperscan scratch space is not thread-safe, so keep one per thread
+_scan_state = threading.local()
+
+
+def _on_scientific_match(pattern_id, start, end, flags, hits):
+    hits.add(pattern_id)
+
+
+def _scan_scientific(text: str) -> set:
+    """Return the ids of the pattern groups (formula/citation) found in text"""
+    scratch = getattr(_scan_state, "scratch", None)
+    if scratch is None:
+        scratch = _scan_state.scratch = hyperscan.Scratch(_SCIENTIFIC_DB)
+    
+    hits = set()
+    _SCIENTIFIC_DB.scan(text.encode("utf-8"), match_event_handler=_on_scientific_match, context=hits, scratch=scratch)
+    return hits
+
+# MinerU pipes are built once; _mineru_missing remembers a failed import
+_init_lock = asyncio.Lock()
+_mineru_missing = False
+
+
 class MinerUPipeline:
     def __init__(self):
         self.model_name = "mineru"
@@ -19,26 +213,38 @@ class MinerUPipeline:
         
     async def initialize(self):
         """Initialize MinerU model"""
-        try:
-            # Try to import and initialize MinerU
-            from magic_pdf.pipe.UNIPipe import UNIPipe
-            from magic_pdf.pipe.OCRPipe import OCRPipe
-            from magic_pdf.pipe.TXTPipe import TXTPipe
-            
-            # Initialize the unified pipeline for PDF processing
-            self.uni_pipe = UNIPipe()
-            self.ocr_pipe = OCRPipe()
-            self.txt_pipe = TXTPipe()
-            
-            self.initialized = True
-            logger.info("MinerU model initialized successfully")
+        global _mineru_missing
+        
+        # A missing install won't appear mid-process; don't retry the imports
+        if _mineru_missing:
+            return
+        
+        # Concurrent first requests wait here instead of each building the pipes
+        async with _init_lock:
+            if self.initialized or _mineru_missing:
+                return
             
-        except ImportError as e:
-            logger.warning(f"MinerU not available, using fallback with scientific enhancement: {e}")
-            self.initialized = False
-        except Exception as e:
-            logger.error(f"Failed to initialize MinerU: {e}")
-            self.initialized = False
+            try:
+                # Try to import and initialize MinerU
+                from magic_pdf.pipe.UNIPipe import UNIPipe
+                from magic_pdf.pipe.OCRPipe import OCRPipe
+                from magic_pdf.pipe.TXTPipe import TXTPipe
+                
+                # Initialize the unified pipeline for PDF processing
+                self.uni_pipe = UNIPipe()
+                self.ocr_pipe = OCRPipe()
+                self.txt_pipe = TXTPipe()
+                
+                self.initialized = True
+                logger.info("MinerU model initialized successfully")
+                
+            except ImportError as e:
+                logger.warning(f"MinerU not available, using fallback with scientific enhancement: {e}")
+                self.initialized = False
+                _mineru_missing = True
+            except Exception as e:
+                logger.error(f"Failed to initialize MinerU: {e}")
+                self.initialized = False
     
     async def extract(self, file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
         """Extract content from PDF using MinerU for scientific documents"""
@@ -65,16 +271,23 @@ class MinerUPipeline:
             # Enhance with scientific content detection
             elements = self._enhance_scientific_elements(elements, markdown_content)
             
+            # Tally types and confidence in one pass
+            type_counts = Counter()
+            confidence_sum = 0.0
+            for element in elements:
+                type_counts[element["type"]] += 1
+                confidence_sum += element["confidence"]
+            
             # Generate metadata specific to scientific documents
             metadata = {
                 "total_pages": result.get('total_pages', 0),
                 "total_elements": len(elements),
-                "by_type": self._count_by_type(elements),
-                "confidence_avg": sum(e["confidence"] for e in elements) / len(elements) if elements else 0.92,
-                "formulas_detected": len([e for e in elements if e["type"] == "equation"]),
-                "citations_detected": len([e for e in elements if e["type"] == "citation"]),
-                "tables_detected": len([e for e in elements if e["type"] == "table"]),
-                "figures_detected": len([e for e in elements if e["type"] == "image"]),
+                "by_type": dict(type_counts),
+                "confidence_avg": confidence_sum / len(elements) if elements else 0.92,
+                "formulas_detected": type_counts["equation"],
+                "citations_detected": type_counts["citation"],
+                "tables_detected": type_counts["table"],
+                "figures_detected": type_counts["image"],
                 "features_detected": ["formulas", "citations", "tables", "figures", "academic_structure"],
                 "model_version": "mineru_v1.0"
             }
@@ -137,121 +350,73 @@ class MinerUPipeline:
     def _contains_formula(self, text: str) -> bool:
         """Check if text contains mathematical formulas"""
         # Look for common mathematical patterns
-        formula_patterns = [
-            r'\$.*?\$',  # LaTeX inline math
-            r'\$\$.*?\$\$',  # LaTeX display math
-            r'\\[a-zA-Z]+\{.*?\}',  # LaTeX commands
-            r'[∑∏∫∂∇∞±≤≥≠≈∝∈∉⊂⊃∪∩]',  # Mathematical symbols
-            r'[α-ωΑ-Ω]',  # Greek letters
-            r'\b\d+\s*[+\-*/=]\s*\d+',  # Basic equations
-            r'\b[a-zA-Z]\s*=\s*[^,;.]+',  # Variable assignments
-        ]
-        
-        for pattern in formula_patterns:
-            if re.search(pattern, text):
-                return True
-        return False
+        if _FORMULA_PREFILTER_RE.search(text) is None:
+            return False
+        return _FORMULA_RE.search(text) is not None
     
     def _extract_latex(self, text: str) -> str:
         """Extract LaTeX from text"""
-        # Find LaTeX patterns and clean them up
-        latex_matches = re.findall(r'\$\$?(.*?)\$\$?', text)
-        if latex_matches:
-            return latex_matches[0]
+        # Only the first LaTeX span is used, so stop at the first match
+        latex_match = _LATEX_RE.search(text)
+        if latex_match:
+            return latex_match.group(1)
         
         # If no explicit LaTeX, try to convert mathematical expressions
         return self._convert_to_latex(text)
     
     def _convert_to_latex(self, text: str) -> str:
         """Convert mathematical expressions to LaTeX"""
-        # Basic conversion of common mathematical expressions
-        latex = text
-        
-        # Replace common symbols
-        replacements = {
-            '±': r'\pm',
-            '≤': r'\leq',
-            '≥': r'\geq',
-            '≠': r'\neq',
-            '≈': r'\approx',
-            '∝': r'\propto',
-            '∈': r'\in',
-            '∉': r'\notin',
-            '⊂': r'\subset',
-            '⊃': r'\supset',
-            '∪': r'\cup',
-            '∩': r'\cap',
-            '∑': r'\sum',
-            '∏': r'\prod',
-            '∫': r'\int',
-            '∂': r'\partial',
-            '∇': r'\nabla',
-            '∞': r'\infty',
-        }
-        
-        for symbol, latex_symbol in replacements.items():
-            latex = latex.replace(symbol, latex_symbol)
-        
-        return latex
+        # Single pass over the text; every source symbol is one code point
+        return text.translate(_SYMBOL_MAP)
     
-    def _contains_citation(self, text: str) -> bool:
-        """Check if text contains citations"""
-        citation_patterns = [
-            r'\[[\d\s,\-]+\]',  # [1], [1,2], [1-3]
-            r'\([^)]*\d{4}[^)]*\)',  # (Author, 2021)
-            r'et al\.',  # "et al."
-            r'ibid\.',  # "ibid."
-            r'op\. cit\.',  # "op. cit."
-        ]
-        
-        for pattern in citation_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                return True
-        return False
+    def _contains_citation(self, text: str, text_lower: Optional[str] = None) -> bool:
+        """Check if text contains citations; callers that already lowercased it can pass text_lower"""
+        if _CITATION_PREFILTER_RE.search(text) is None:
+            return False
+        if text_lower is None:
+            text_lower = text.lower()
+        return _CITATION_RE.search(text_lower) is not None
     
     def _extract_references(self, text: str) -> List[str]:
         """Extract reference numbers/keys from citation text"""
-        references = []
+        # Collected straight into a set, which also removes duplicates
+        references = set()
         
         # Extract numbers from square brackets
-        bracket_refs = re.findall(r'\[([\d\s,\-]+)\]', text)
-        for ref in bracket_refs:
+        for ref in _BRACKET_REFS_RE.findall(text):
             # Split by commas and handle ranges
             for part in ref.split(','):
                 part = part.strip()
                 if '-' in part:
                     # Handle ranges like "1-3"
                     start, end = part.split('-')
-                    for i in range(int(start.strip()), int(end.strip()) + 1):
-                        references.append(str(i))
+                    references.update(map(str, range(int(start), int(end) + 1)))
                 else:
-                    references.append(part)
+                    references.add(part)
         
         # Extract author-year citations
-        author_year = re.findall(r'\(([^)]*\d{4}[^)]*)\)', text)
-        references.extend(author_year)
+        references.update(_AUTHOR_YEAR_RE.findall(text))
         
-        return list(set(references))  # Remove duplicates
+        return list(references)
     
-    def _is_academic_section(self, text: str) -> bool:
-        """Check if text is an academic section header"""
-        academic_sections = [
-            'abstract', 'introduction', 'methodology', 'methods', 'results',
-            'discussion', 'conclusion', 'acknowledgments', 'references',
-            'bibliography', 'appendix', 'related work', 'background',
-            'literature review', 'experimental setup', 'evaluation',
-            'future work', 'limitations'
-        ]
+    def _is_academic_section(self, text: str, text_lower: Optional[str] = None) -> bool:
+        """Check if text is an academic section header; text_lower is the stripped, lowercased text if known"""
+        if text_lower is None:
+            text_lower = text.lower().strip()
         
-        text_lower = text.lower().strip()
+        # Bare headers ("Abstract", "2. Results") hit the set directly
+        if text_lower.lstrip('0123456789. ') in _ACADEMIC_SECTIONS:
+            return True
         
-        # Check for exact matches or section numbering
-        for section in academic_sections:
-            if section in text_lower or text_lower == section:
+        # Otherwise any section keyword inside the text still counts
+        if _ACADEMIC_SECTION_AC is not None:
+            if next(_ACADEMIC_SECTION_AC.iter(text_lower), None) is not None:
                 return True
+        elif _ACADEMIC_SECTION_RE.search(text_lower):
+            return True
         
         # Check for numbered sections (1. Introduction, etc.)
-        if re.match(r'^\d+\.?\s+[A-Z]', text.strip()):
+        if _NUMBERED_SECTION_RE.match(text.strip()):
             return True
         
         return False
@@ -260,196 +425,54 @@ class MinerUPipeline:
         """Get the type of academic section"""
         text_lower = text.lower().strip()
         
-        section_types = {
-            'abstract': 'abstract',
-            'introduction': 'introduction',
-            'methodology': 'methods',
-            'methods': 'methods',
-            'results': 'results',
-            'discussion': 'discussion',
-            'conclusion': 'conclusion',
-            'acknowledgments': 'acknowledgments',
-            'references': 'references',
-            'bibliography': 'references',
-            'appendix': 'appendix'
-        }
+        section_type = _SECTION_TYPE_MAP.get(text_lower.lstrip('0123456789. '))
+        if section_type is not None:
+            return section_type
+        
+        # Keywords are checked in priority order, not by position in the text
+        if _SECTION_TYPE_AC is not None:
+            matches = [match for _, match in _SECTION_TYPE_AC.iter(text_lower)]
+            return min(matches)[1] if matches else 'other'
         
-        for keyword, section_type in section_types.items():
+        for keyword, section_type in _SECTION_TYPE_MAP.items():
             if keyword in text_lower:
                 return section_type
         
         return 'other'
     
-    def _count_by_type(self, elements: List[Dict]) -> Dict[str, int]:
-        """Count elements by type"""
-        counts = {}
-        for element in elements:
-            element_type = element["type"]
-            counts[element_type] = counts.get(element_type, 0) + 1
-        return counts
-    
     async def _scientific_fallback_extraction(self, file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
         """Enhanced fallback extraction for scientific documents using PyMuPDF"""
         try:
-            doc = fitz.open(file_path)
-            
-            markdown_content = ""
+            # Merge the pages, tallying types, confidence and academic sections in the same pass
+            page_count = 0
+            markdown_parts = []
             elements = []
+            type_counts = Counter()
+            confidence_sum = 0.0
+            academic_sections = 0
+            async for _, page_content, page_elements in self.iter_pages(file_path):
+                page_count += 1
+                markdown_parts.append(page_content)
+                for element in page_elements:
+                    type_counts[element["type"]] += 1
+                    confidence_sum += element["confidence"]
+                    if element["type"] == "header" and element.get("section_type"):
+                        academic_sections += 1
+                elements.extend(page_elements)
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                
-                # Extract text blocks
-                blocks = page.get_text("dict")
-                page_content = f"\n\n## Page {page_num + 1}\n\n"
-                
-                for block_idx, block in enumerate(blocks["blocks"]):
-                    if "lines" not in block:
-                        continue
-                    
-                    block_text = ""
-                    block_bbox = block["bbox"]
-                    
-                    for line in block["lines"]:
-                        line_text = ""
-                        for span in line["spans"]:
-                            line_text += span["text"]
-                        
-                        if line_text.strip():
-                            block_text += line_text + "\n"
-                    
-                    if block_text.strip():
-                        # Enhanced classification for scientific content
-                        element_type = self._classify_scientific_block(block_text, block_bbox)
-                        
-                        element = {
-                            "id": f"page_{page_num}_block_{block_idx}",
-                            "type": element_type,
-                            "content": block_text.strip(),
-                            "bbox": {
-                                "x1": block_bbox[0],
-                                "y1": block_bbox[1],
-                                "x2": block_bbox[2],
-                                "y2": block_bbox[3],
-                                "page": page_num
-                            },
-                            "confidence": 0.88
-                        }
-                        
-                        # Add scientific-specific metadata
-                        if element_type == "equation":
-                            element["latex"] = self._extract_latex(block_text)
-                        elif element_type == "citation":
-                            element["references"] = self._extract_references(block_text)
-                        elif element_type == "header" and self._is_academic_section(block_text):
-                            element["section_type"] = self._get_section_type(block_text)
-                        
-                        elements.append(element)
-                        
-                        # Add to markdown with scientific formatting
-                        if element_type == "equation":
-                            page_content += f"$$\n{self._extract_latex(block_text)}\n$$\n\n"
-                        elif element_type == "title":
-                            page_content += f"# {block_text.strip()}\n\n"
-                        elif element_type == "header":
-                            page_content += f"## {block_text.strip()}\n\n"
-                        elif element_type == "citation":
-                            page_content += f"> {block_text.strip()}\n\n"
-                        else:
-                            page_content += f"{block_text.strip()}\n\n"
-                
-                # Enhanced table extraction for scientific content
-                try:
-                    tables = page.find_tables()
-                    for table_idx, table in enumerate(tables):
-                        table_data = table.extract()
-                        if table_data:
-                            table_bbox = table.bbox
-                            elements.append({
-                                "id": f"page_{page_num}_table_{table_idx}",
-                                "type": "table",
-                                "content": self._format_scientific_table(table_data),
-                                "bbox": {
-                                    "x1": table_bbox[0],
-                                    "y1": table_bbox[1],
-                                    "x2": table_bbox[2],
-                                    "y2": table_bbox[3],
-                                    "page": page_num
-                                },
-                                "confidence": 0.85,
-                                "table_type": self._classify_table_type(table_data)
-                            })
-                            
-                            page_content += f"\n{self._format_scientific_table(table_data)}\n\n"
-                except:
-                    pass
-                
-                # Extract images from the page
-                try:
-                    image_list = page.get_images(full=True)
-                    for img_idx, img in enumerate(image_list):
-                        # Get image info
-                        xref = img[0]
-                        pix = fitz.Pixmap(doc, xref)
-                        
-                        # Skip very small images (likely decorative)
-                        if pix.width < 50 or pix.height < 50:
-                            pix = None
-                            continue
-                        
-                        # Get image bbox - estimate from page content if not available
-                        img_bbox = self._estimate_image_bbox(page, xref, pix)
-                        
-                        # Create image element
-                        image_element = {
-                            "id": f"page_{page_num}_image_{img_idx}",
-                            "type": "image",
-                            "content": f"[Image: {pix.width}x{pix.height} pixels]",
-                            "bbox": {
-                                "x1": img_bbox[0],
-                                "y1": img_bbox[1],
-                                "x2": img_bbox[2],
-                                "y2": img_bbox[3],
-                                "page": page_num
-                            },
-                            "confidence": 0.95,
-                            "image_info": {
-                                "width": pix.width,
-                                "height": pix.height,
-                                "colorspace": pix.colorspace.name if pix.colorspace else "Unknown",
-                                "xref": xref,
-                                "size_bytes": len(pix.tobytes())
-                            }
-                        }
-                        
-                        elements.append(image_element)
-                        
-                        # Add image to markdown
-                        page_content += f"\n![Image {img_idx + 1}](image_{page_num}_{img_idx}.png)\n"
-                        page_content += f"*Image: {pix.width}x{pix.height} pixels*\n\n"
-                        
-                        # Clean up pixmap
-                        pix = None
-                        
-                except Exception as e:
-                    logger.warning(f"Image extraction failed for page {page_num}: {e}")
-                    pass
-                
-                markdown_content += page_content
-            
-            doc.close()
+            markdown_content = "".join(markdown_parts)
             
             # Enhanced metadata for scientific documents
             metadata = {
-                "total_pages": len(doc),
+                "total_pages": page_count,
                 "total_elements": len(elements),
-                "by_type": self._count_by_type(elements),
-                "confidence_avg": sum(e["confidence"] for e in elements) / len(elements) if elements else 0.88,
-                "formulas_detected": len([e for e in elements if e["type"] == "equation"]),
-                "citations_detected": len([e for e in elements if e["type"] == "citation"]),
-                "tables_detected": len([e for e in elements if e["type"] == "table"]),
-                "figures_detected": len([e for e in elements if e["type"] == "image"]),
-                "academic_sections": len([e for e in elements if e["type"] == "header" and e.get("section_type")]),
+                "by_type": dict(type_counts),
+                "confidence_avg": confidence_sum / len(elements) if elements else 0.88,
+                "formulas_detected": type_counts["equation"],
+                "citations_detected": type_counts["citation"],
+                "tables_detected": type_counts["table"],
+                "figures_detected": type_counts["image"],
+                "academic_sections": academic_sections,
                 "features_detected": ["text", "formulas", "citations", "tables", "academic_structure"],
                 "model_version": "mineru_fallback_v1.0"
             }
@@ -471,20 +494,212 @@ class MinerUPipeline:
                 "error": str(e)
             }
     
+    async def iter_pages(self, file_path: str) -> AsyncIterator[Tuple[int, str, List[Dict[str, Any]]]]:
+        """Yield (page_num, page_markdown, page_elements) in page order from the PyMuPDF page extractor"""
+        page_count = await asyncio.to_thread(self._page_count, file_path)
+        
+        # Pages are independent and run in the shared process pool (PyMuPDF parsing
+        # holds the GIL), but only a bounded window is in flight, so a long paper is
+        # never held in memory all at once unless the consumer keeps it
+        loop = asyncio.get_running_loop()
+        pool = get_page_pool()
+        window = 2 * PAGE_POOL_WORKERS
+        pending = deque()
+        try:
+            for page_num in range(page_count):
+                pending.append((page_num, loop.run_in_executor(pool, _extract_page_worker, file_path, page_num)))
+                if len(pending) >= window:
+                    done_page, future = pending.popleft()
+                    page_content, page_elements = await future
+                    yield done_page, page_content, page_elements
+            
+            while pending:
+                done_page, future = pending.popleft()
+                page_content, page_elements = await future
+                yield done_page, page_content, page_elements
+        finally:
+            # The consumer stopped early or a page failed: drop pages not yet started
+            for _, future in pending:
+                future.cancel()
+    
+    def _page_count(self, file_path: str) -> int:
+        """Get the number of pages in a PDF"""
+        doc = fitz.open(file_path)
+        try:
+            return len(doc)
+        finally:
+            doc.close()
+    
+    def _extract_page(self, file_path: str, page_num: int) -> Tuple[str, List[Dict[str, Any]]]:
+        """Extract markdown and elements from one page; opens its own document so pages can run in parallel"""
+        doc = fitz.open(file_path)
+        try:
+            # Markdown pieces for the page, joined once at the end
+            page_parts = []
+            elements = []
+            
+            page = doc[page_num]
+            
+            # Extract text blocks; the flat "blocks" output already has each block's lines
+            # joined by MuPDF. Image blocks are kept (as short descriptions, not bytes) so
+            # block numbers, and the element ids built from them, match the full page structure
+            blocks = page.get_text("blocks", flags=fitz.TEXTFLAGS_TEXT | fitz.TEXT_PRESERVE_IMAGES)
+            page_parts.append(f"\n\n## Page {page_num + 1}\n\n")
+            
+            for x0, y0, x1, y1, block_text, block_no, block_type in blocks:
+                if block_type != 0:  # not a text block
+                    continue
+                
+                block_bbox = (x0, y0, x1, y1)
+                
+                if block_text.strip():
+                    # Enhanced classification for scientific content
+                    element_type = self._classify_scientific_block(block_text, block_bbox)
+                    
+                    element = {
+                        "id": f"page_{page_num}_block_{block_no}",
+                        "type": element_type,
+                        "content": block_text.strip(),
+                        "bbox": {
+                            "x1": block_bbox[0],
+                            "y1": block_bbox[1],
+                            "x2": block_bbox[2],
+                            "y2": block_bbox[3],
+                            "page": page_num
+                        },
+                        "confidence": 0.88
+                    }
+                    
+                    # Add scientific-specific metadata; an equation's LaTeX is
+                    # extracted once and reused for the markdown below
+                    if element_type == "equation":
+                        latex = self._extract_latex(block_text)
+                        element["latex"] = latex
+                    elif element_type == "citation":
+                        element["references"] = self._extract_references(block_text)
+                    elif element_type == "header":
+                        # Only _is_academic_section produces "header", so it isn't re-run here
+                        element["section_type"] = self._get_section_type(block_text)
+                    
+                    elements.append(element)
+                    
+                    # Add to markdown with scientific formatting
+                    if element_type == "equation":
+                        page_parts.append(f"$$\n{latex}\n$$\n\n")
+                    elif element_type == "title":
+                        page_parts.append(f"# {block_text.strip()}\n\n")
+                    elif element_type == "header":
+                        page_parts.append(f"## {block_text.strip()}\n\n")
+                    elif element_type == "citation":
+                        page_parts.append(f"> {block_text.strip()}\n\n")
+                    else:
+                        page_parts.append(f"{block_text.strip()}\n\n")
+            
+            # Enhanced table extraction for scientific content; table detection works
+            # from ruling lines, so pages without any vector drawings can't contain one
+            try:
+                tables = page.find_tables() if page.get_cdrawings() else []
+                for table_idx, table in enumerate(tables):
+                    table_data = table.extract()
+                    if table_data:
+                        table_bbox = table.bbox
+                        table_markdown = self._format_scientific_table(table_data)
+                        elements.append({
+                            "id": f"page_{page_num}_table_{table_idx}",
+                            "type": "table",
+                            "content": table_markdown,
+                            "bbox": {
+                                "x1": table_bbox[0],
+                                "y1": table_bbox[1],
+                                "x2": table_bbox[2],
+                                "y2": table_bbox[3],
+                                "page": page_num
+                            },
+                            "confidence": 0.85,
+                            "table_type": self._classify_table_type(table_data)
+                        })
+                        
+                        page_parts.append(f"\n{table_markdown}\n\n")
+            except Exception as e:
+                logger.warning(f"Table extraction failed for page {page_num}: {e}")
+            
+            # Extract images from the page
+            try:
+                image_list = page.get_images(full=True)
+                for img_idx, img in enumerate(image_list):
+                    # Get image info
+                    xref = img[0]
+                    pix = fitz.Pixmap(doc, xref)
+                    
+                    # Skip very small images (likely decorative)
+                    if pix.width < 50 or pix.height < 50:
+                        pix = None
+                        continue
+                    
+                    # Get image bbox - estimate from page content if not available
+                    img_bbox = self._estimate_image_bbox(page, xref, pix)
+                    
+                    # Create image element
+                    image_element = {
+                        "id": f"page_{page_num}_image_{img_idx}",
+                        "type": "image",
+                        "content": f"[Image: {pix.width}x{pix.height} pixels]",
+                        "bbox": {
+                            "x1": img_bbox[0],
+                            "y1": img_bbox[1],
+                            "x2": img_bbox[2],
+                            "y2": img_bbox[3],
+                            "page": page_num
+                        },
+                        "confidence": 0.95,
+                        "image_info": {
+                            "width": pix.width,
+                            "height": pix.height,
+                            "colorspace": pix.colorspace.name if pix.colorspace else "Unknown",
+                            "xref": xref,
+                            "size_bytes": len(pix.tobytes())
+                        }
+                    }
+                    
+                    elements.append(image_element)
+                    
+                    # Add image to markdown
+                    page_parts.append(f"\n![Image {img_idx + 1}](image_{page_num}_{img_idx}.png)\n")
+                    page_parts.append(f"*Image: {pix.width}x{pix.height} pixels*\n\n")
+                    
+                    # Clean up pixmap
+                    pix = None
+                    
+            except Exception as e:
+                logger.warning(f"Image extraction failed for page {page_num}: {e}")
+                pass
+            
+            return "".join(page_parts), elements
+        finally:
+            doc.close()
+    
     def _classify_scientific_block(self, text: str, bbox: List[float]) -> str:
         """Classify text block with scientific content awareness"""
         text_lower = text.lower().strip()
         
-        # Check for mathematical formulas
-        if self._contains_formula(text):
-            return "equation"
-        
-        # Check for citations
-        if self._contains_citation(text):
-            return "citation"
+        if _SCIENTIFIC_DB is not None:
+            # One Hyperscan pass covers both formula and citation patterns
+            hits = _scan_scientific(text)
+            if _FORMULA_ID in hits:
+                return "equation"
+            if _CITATION_ID in hits:
+                return "citation"
+        else:
+            # Check for mathematical formulas
+            if self._contains_formula(text):
+                return "equation"
+            
+            # Check for citations
+            if self._contains_citation(text, text_lower):
+                return "citation"
         
         # Check for academic section headers
-        if self._is_academic_section(text):
+        if self._is_academic_section(text, text_lower):
             return "header"
         
         # Check for figure/table captions
@@ -504,12 +719,12 @@ class MinerUPipeline:
         if not table_data or not table_data[0]:
             return ""
         
-        markdown = ""
-        
         # Header row
         headers = table_data[0]
-        markdown += "| " + " | ".join(headers) + " |\n"
-        markdown += "| " + " | ".join(["---"] * len(headers)) + " |\n"
+        rows = [
+            "| " + " | ".join(headers) + " |\n",
+            "| " + " | ".join(["---"] * len(headers)) + " |\n",
+        ]
         
         # Data rows with formula detection
         for row in table_data[1:]:
@@ -521,9 +736,9 @@ class MinerUPipeline:
                         formatted_row.append(f"${self._extract_latex(cell)}$")
                     else:
                         formatted_row.append(cell)
-                markdown += "| " + " | ".join(formatted_row) + " |\n"
+                rows.append("| " + " | ".join(formatted_row) + " |\n")
         
-        return markdown
+        return "".join(rows)
     
     def _classify_table_type(self, table_data: List[List[str]]) -> str:
         """Classify the type of scientific table"""
@@ -532,22 +747,16 @@ class MinerUPipeline:
         
         # Check headers for common scientific table types
         headers = [h.lower() for h in table_data[0]] if table_data[0] else []
+        header_text = ' '.join(headers)
         
-        # Results/data tables
-        if any(word in ' '.join(headers) for word in ['result', 'data', 'value', 'measurement', 'experiment']):
-            return "results"
-        
-        # Statistical tables
-        if any(word in ' '.join(headers) for word in ['mean', 'std', 'p-value', 'significance', 'correlation']):
-            return "statistics"
-        
-        # Comparison tables
-        if any(word in ' '.join(headers) for word in ['method', 'approach', 'algorithm', 'model', 'comparison']):
-            return "comparison"
+        # Results, statistics, comparison, then parameter tables
+        if _TABLE_TYPE_AC is not None:
+            matches = [priority for _, priority in _TABLE_TYPE_AC.iter(header_text)]
+            return _TABLE_TYPE_KEYWORDS[min(matches)][0] if matches else "data"
         
-        # Parameter tables
-        if any(word in ' '.join(headers) for word in ['parameter', 'setting', 'configuration', 'hyperparameter']):
-            return "parameters"
+        for table_type, words in _TABLE_TYPE_KEYWORDS:
+            if any(word in header_text for word in words):
+                return table_type
         
         return "data"
     
@@ -588,6 +797,17 @@ class MinerUPipeline:
 mineru_pipeline = MinerUPipeline()
 
 
+def _extract_page_worker(file_path: str, page_num: int) -> Tuple[str, List[Dict[str, Any]]]:
+    """Process-pool entry point for fallback page extraction (module-level so it pickles)"""
+    return mineru_pipeline._extract_page(file_path, page_num)
+
+
 async def process_with_mineru(file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
     """Process PDF with MinerU pipeline for scientific documents"""
-    return await mineru_pipeline.extract(file_path, options)
\ No newline at end of file
+    return await mineru_pipeline.extract(file_path, options)
+
+
+async def stream_with_mineru(file_path: str) -> AsyncIterator[Tuple[int, str, List[Dict[str, Any]]]]:
+    """Stream (page_num, page_markdown, page_elements) per page with MinerU's scientific page extractor"""
+    async for page in mineru_pipeline.iter_pages(file_path):
+        yield page
\ No newline at end of file
@@ -0,0 +1,37 @@
+"""
+Shared worker process pool for per-page PDF work in the model pipelines
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+# os.cpu_count() reports the host's cores inside a container, not the share it
+# reserved, so the default is the CPUs this process may run on, capped;
+# PDF_PAGE_WORKERS sets the count explicitly
+MAX_DEFAULT_PAGE_WORKERS = 4
+PAGE_POOL_WORKERS = max(1, int(os.environ.get(
+    "PDF_PAGE_WORKERS",
+    min(len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1, MAX_DEFAULT_PAGE_WORKERS),
+)))
+
+_page_pool: Optional[ProcessPoolExecutor] = None
+_page_pool_lock = threading.Lock()
+
+def get_page_pool() -> ProcessPoolExecutor:
+    """Get the process pool shared by every pipeline's page work, creating it on first use"""
+    global _page_pool
+    # Pipelines reach this from the event loop and from to_thread workers, so creation is locked
+    with _page_pool_lock:
+        if _page_pool is None:
+            # forkserver: forking a process that runs threads (the model thread, torch,
+            # CUDA) can copy held locks and device state into the workers
+            _page_pool = ProcessPoolExecutor(
+                max_workers=PAGE_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+            atexit.register(_page_pool.shutdown)
+    return _page_pool
@@ -4,25 +4,111 @@ Advanced OCR and layout analysis with support for 90+ languages
 """
 
 import asyncio
+import atexit
+import hashlib
+import os
+import tempfile
 import fitz  # PyMuPDF for fallback
-from typing import Dict, List, Any, Optional
+import orjson
+from typing import Dict, List, Any, AsyncIterator, Optional, Tuple
 import logging
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 from PIL import Image
-import io
+
+from .page_pool import PAGE_POOL_WORKERS, get_page_pool
 
 logger = logging.getLogger(__name__)
 
+# Single thread that runs every Surya model call, keeping the event loop free
+# while OCR runs; one worker serializes requests' access to the GPU
+_model_pool: Optional[ThreadPoolExecutor] = None
+
+def get_model_pool() -> ThreadPoolExecutor:
+    """Get the shared model-call thread, creating it on first use"""
+    global _model_pool
+    if _model_pool is None:
+        _model_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="surya-models")
+        atexit.register(_model_pool.shutdown)
+    return _model_pool
+
+
+# OCR render scale, and the longest image edge (pixels) a page may render to;
+# oversize pages (A3, posters) are scaled down to fit instead of ballooning
+RENDER_ZOOM = 2.0
+MAX_RENDER_LONG_EDGE = int(os.environ.get("SURYA_MAX_LONG_EDGE", 2048))
+
+# Embedded-text probe: documents whose first TEXT_PROBE_PAGES pages hold more than
+# TEXT_PROBE_MIN_CHARS characters of text are read directly instead of OCR'd
+TEXT_PROBE_PAGES = 3
+TEXT_PROBE_MIN_CHARS = 200
+
+
+def _render_page(file_path: str, page_num: int) -> Tuple[float, int, int, bytes, bytes]:
+    """Render one page to raw RGB samples plus their digest (process-pool entry point, module-level so it pickles)"""
+    doc = fitz.open(file_path)
+    try:
+        page = doc[page_num]
+        zoom = min(RENDER_ZOOM, MAX_RENDER_LONG_EDGE / max(page.rect.width, page.rect.height))
+        
+        # Raw samples skip a PNG deflate here and the inflate in the parent
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        samples = pix.samples
+        # Hashed here, in parallel, so identical pages can share one OCR pass
+        return zoom, pix.width, pix.height, samples, hashlib.blake2b(samples, digest_size=16).digest()
+    finally:
+        doc.close()
+
+# Finished OCR results are kept on disk, keyed by the PDF's contents and the
+# options, so re-extracting a document skips the models; SURYA_CACHE_DIR=""
+# turns this off. Bump RESULT_CACHE_VERSION whenever the output format changes.
+RESULT_CACHE_DIR = os.environ.get("SURYA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "surya_results"))
+RESULT_CACHE_VERSION = 1
+# Least recently used entries are deleted once the cache passes this size
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("SURYA_CACHE_MAX_BYTES", 1 << 30))  # 1 GB
+
+# Surya's models are loaded once; _surya_missing remembers a failed import
+_init_lock = asyncio.Lock()
+_surya_missing = False
+
+# Element type per layout label, filled in as labels are first seen; None marks
+# labels that don't decide a type. Surya emits only a handful of distinct labels.
+_layout_category_cache: Dict[str, Optional[str]] = {}
+
+
 class SuryaPipeline:
     def __init__(self):
         self.model_name = "surya"
         self.initialized = False
         self.ocr_model = None
         self.layout_model = None
+        # Pages per model call; SURYA_BATCH lowers it for small-VRAM GPUs
+        self.ocr_batch_size = max(1, int(os.environ.get("SURYA_BATCH", 8)))
         
     async def initialize(self):
         """Initialize Surya models"""
+        # A missing install won't appear mid-process; don't retry the imports
+        if _surya_missing:
+            return
+        
+        # Model loading and warm-up await the model thread, so concurrent first requests
+        # wait here instead of each loading (and compiling) another copy onto the GPU
+        async with _init_lock:
+            if self.initialized or _surya_missing:
+                return
+            await self._load_models()
+    
+    async def _load_models(self):
+        """Import Surya, load its models and warm them up"""
+        global _surya_missing
+        
         try:
+            # Let the CUDA caching allocator grow segments in place rather than fragment
+            # across differently sized batches; it is read at the first CUDA allocation,
+            # so it has to be set before the models load
+            os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+            
             # Try to import and initialize Surya
             from surya.ocr import run_ocr
             from surya.model.detection.segformer import load_model as load_det_model, load_processor as load_det_processor
@@ -38,10 +124,50 @@ class SuryaPipeline:
             self.rec_model, self.rec_processor = load_rec_model(), load_rec_processor()
             self.order_model, self.order_processor = load_order_model(), load_order_processor()
             
+            # Let float32 matmuls and convolutions use TF32 tensor cores on Ampere+ GPUs
+            import torch
+            if torch.cuda.is_available():
+                torch.set_float32_matmul_precision("high")
+                torch.backends.cuda.matmul.allow_tf32 = True
+                torch.backends.cudnn.allow_tf32 = True
+                # Surya's processors resize pages to fixed input shapes, so cuDNN
+                # autotuning runs once (during warm-up) and is reused afterwards
+                torch.backends.cudnn.benchmark = True
+                
+                # Optional cap on this process's share of GPU memory, for GPUs shared
+                # with other services (e.g. SURYA_GPU_MEMORY_FRACTION=0.8)
+                memory_fraction = os.environ.get("SURYA_GPU_MEMORY_FRACTION")
+                if memory_fraction:
+                    torch.cuda.set_per_process_memory_fraction(float(memory_fraction))
+                
+                # Fuse the segformer detector (used for both text detection and layout)
+                # with Inductor; its inputs are fixed-size, unlike the autoregressive
+                # recognition and ordering decoders, which would recompile per shape.
+                # SURYA_COMPILE=0 turns this off.
+                if os.environ.get("SURYA_COMPILE", "1") != "0":
+                    import torch._inductor.config
+                    # Reuse compiled kernels from disk across processes. The cache lives
+                    # under /tmp by default, which a new container starts without; point
+                    # TORCHINDUCTOR_CACHE_DIR at a mounted volume to keep it across restarts
+                    torch._inductor.config.fx_graph_cache = True
+                    self.det_model = torch.compile(self.det_model)
+            
             # Store required functions
             self.run_ocr = run_ocr
             self.batch_layout_detection = batch_layout_detection
             self.batch_ordering = batch_ordering
+            # Model calls run with autograd fully off (no version counters or grad tracking)
+            self.inference_mode = torch.inference_mode
+            # No-op until CUDA has been used
+            self.empty_cache = torch.cuda.empty_cache
+            
+            # Pay kernel compilation and autotuning here instead of on the first request,
+            # on the model thread so the event loop keeps serving meanwhile; if the
+            # compiled detector can't run, go back to the eager one
+            warmed_up = await asyncio.get_running_loop().run_in_executor(get_model_pool(), self._warm_up_models)
+            if not warmed_up and hasattr(self.det_model, "_orig_mod"):
+                logger.warning("Compiled Surya detector failed warm-up, using eager mode")
+                self.det_model = self.det_model._orig_mod
             
             self.initialized = True
             logger.info("Surya OCR models initialized successfully")
@@ -49,11 +175,117 @@ class SuryaPipeline:
         except ImportError as e:
             logger.warning(f"Surya not available, using fallback OCR: {e}")
             self.initialized = False
+            _surya_missing = True
         except Exception as e:
             logger.error(f"Failed to initialize Surya: {e}")
             self.initialized = False
     
+    def _warm_up_models(self) -> bool:
+        """Run one full-size batch of blank pages through every model; returns False (and logs) on failure"""
+        try:
+            # A blank US Letter page at RENDER_ZOOM, the most common real input size
+            dummy = Image.new("RGB", (int(612 * RENDER_ZOOM), int(792 * RENDER_ZOOM)), (255, 255, 255))
+            self._run_models([dummy] * self.ocr_batch_size, ["en"])
+            return True
+        except Exception as e:
+            logger.warning(f"Surya warm-up failed, first request will be slower: {e}")
+            return False
+    
     async def extract(self, file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Extract content from PDF using Surya OCR, reusing the on-disk result for content seen before"""
+        cache_path = None
+        if RESULT_CACHE_DIR:
+            try:
+                cache_path = await asyncio.to_thread(self._result_cache_path, file_path, options)
+            except OSError as e:
+                logger.error(f"Surya extraction failed: {e}")
+                return self._failed_result(e)
+            except TypeError as e:
+                # Options orjson can't serialize can't be part of a key; extract without the cache
+                logger.warning(f"Not caching Surya result, options are not serializable: {e}")
+        
+        if cache_path:
+            cached = await asyncio.to_thread(self._load_cached_result, cache_path)
+            if cached is not None:
+                return cached
+        
+        result = await self._extract_uncached(file_path, options)
+        # Only OCR output is worth keeping; the PyMuPDF fallback is already fast, and
+        # caching it would keep serving it after Surya becomes available
+        if cache_path and result["success"] and result["metadata"]["model_version"] == "surya_v1.0":
+            await asyncio.to_thread(self._store_cached_result, cache_path, result)
+        return result
+    
+    def _result_cache_path(self, file_path: str, options: Optional[Dict[str, Any]]) -> str:
+        """Cache file for this PDF's contents under these options and render settings"""
+        with open(file_path, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256")
+        digest.update(orjson.dumps(
+            [RESULT_CACHE_VERSION, MAX_RENDER_LONG_EDGE, options or {}],
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+        ))
+        return os.path.join(RESULT_CACHE_DIR, f"{digest.hexdigest()}.json")
+    
+    def _load_cached_result(self, cache_path: str) -> Optional[Dict[str, Any]]:
+        """Read a cached result, or None if there is none or it can't be read"""
+        try:
+            with open(cache_path, "rb") as f:
+                result = orjson.loads(f.read())
+            # Mark the entry recently used for eviction
+            os.utime(cache_path)
+            return result
+        except FileNotFoundError:
+            return None
+        except (OSError, orjson.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable Surya cache entry {cache_path}: {e}")
+            return None
+    
+    def _store_cached_result(self, cache_path: str, result: Dict[str, Any]):
+        """Write a result to the cache; written to a temp file and renamed so readers never see a partial entry"""
+        try:
+            data = orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY)
+            os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+            # A unique temp file per write, so concurrent writers never share one
+            fd, tmp_path = tempfile.mkstemp(dir=RESULT_CACHE_DIR, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, cache_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self._evict_cached_results()
+        except (OSError, TypeError) as e:
+            logger.warning(f"Could not cache Surya result: {e}")
+    
+    def _evict_cached_results(self):
+        """Delete the least recently used cache entries until the cache fits RESULT_CACHE_MAX_BYTES"""
+        entries = []
+        total_size = 0
+        with os.scandir(RESULT_CACHE_DIR) as it:
+            for entry in it:
+                # Skip other writers' in-progress temp files
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+        
+        # Reads touch the mtime, so oldest mtime is least recently used
+        entries.sort()
+        for _, size, entry_path in entries:
+            if total_size <= RESULT_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+    
+    async def _extract_uncached(self, file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
         """Extract content from PDF using Surya OCR"""
         if not self.initialized:
             await self.initialize()
@@ -62,85 +294,128 @@ class SuryaPipeline:
             # Fallback to enhanced PyMuPDF processing
             return await self._fallback_extraction(file_path, options)
         
+        # Born-digital PDFs already carry their text; PyMuPDF reads it in milliseconds
+        # where OCR takes seconds per page. options["force_ocr"] always runs Surya.
+        if not (options and options.get("force_ocr")) and await asyncio.to_thread(self._has_text_layer, file_path):
+            result = await self._fallback_extraction(file_path, options)
+            # Tells callers OCR was skipped on purpose, not because Surya was unavailable
+            if result["success"]:
+                result["metadata"]["features_detected"] = ["text_embedded"]
+            return result
+        
         try:
-            # Convert PDF pages to images
-            doc = fitz.open(file_path)
-            images = []
-            
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                # Render at higher DPI for better OCR
-                mat = fitz.Matrix(2.0, 2.0)
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
-                img = Image.open(io.BytesIO(img_data))
-                images.append(img)
-            
-            doc.close()
+            page_count = await asyncio.to_thread(self._page_count, file_path)
             
             # Language detection (default to multilingual)
             languages = options.get("languages", ["en", "es", "fr", "de", "zh", "ja", "ar"]) if options else ["en"]
             
-            # Run layout detection
-            layout_results = self.batch_layout_detection(images, self.det_model, self.det_processor)
-            
-            # Run OCR on detected regions
-            ocr_results = self.run_ocr(images, [languages] * len(images), self.det_model, self.det_processor, self.rec_model, self.rec_processor)
+            # Render and run the models one fixed-size page batch at a time rather than
+            # the whole document at once, so page images and GPU memory stay bounded
+            # on long PDFs; each batch's images are dropped once its models have run
+            layout_results = []
+            ocr_results = []
+            order_results = []
+            # Factor that maps a downscaled page's boxes back to RENDER_ZOOM pixels,
+            # so every page reports bboxes in the same coordinate space
+            bbox_scales = []
+            # (layout, ocr, order) results per rendered page key; blank pages and repeated
+            # templates or cover sheets render identically and only go through the models once
+            page_results = {}
+            loop = asyncio.get_running_loop()
+            model_pool = get_model_pool()
+            async for batch, batch_scales, batch_keys in self._iter_page_batches(file_path, page_count):
+                bbox_scales.extend(batch_scales)
+                
+                # First occurrence of each page not seen in an earlier batch
+                unique_pages = {}
+                for image, key in zip(batch, batch_keys):
+                    if key not in page_results and key not in unique_pages:
+                        unique_pages[key] = image
+                
+                if unique_pages:
+                    # Models run on the model thread; the next batch keeps rendering meanwhile
+                    batch_layout, batch_ocr, batch_order = await loop.run_in_executor(
+                        model_pool, self._run_models, list(unique_pages.values()), languages
+                    )
+                    for key, layout_result, ocr_result, order_result in zip(unique_pages, batch_layout, batch_ocr, batch_order):
+                        page_results[key] = (layout_result, ocr_result, order_result)
+                
+                # Duplicates share their representative's results; page numbers are
+                # assigned per page when elements are built below
+                for key in batch_keys:
+                    layout_result, ocr_result, order_result = page_results[key]
+                    layout_results.append(layout_result)
+                    ocr_results.append(ocr_result)
+                    order_results.append(order_result)
             
-            # Run reading order detection
-            order_results = self.batch_ordering(images, layout_results, self.order_model, self.order_processor)
+            # Hand the document's cached GPU blocks back once its batches are done,
+            # so memory held between requests doesn't creep up across documents. It can
+            # synchronize the device, so it is queued on the model thread behind any
+            # running batch rather than called here; nothing needs to wait for it
+            model_pool.submit(self.empty_cache)
             
             # Process results
-            markdown_content = ""
+            # Markdown pieces for the whole document, joined once at the end
+            markdown_parts = []
             elements = []
             
             for page_num, (ocr_result, layout_result, order_result) in enumerate(zip(ocr_results, layout_results, order_results)):
-                page_content = f"\n\n## Page {page_num + 1}\n\n"
+                page_parts = [f"\n\n## Page {page_num + 1}\n\n"]
+                scale = bbox_scales[page_num]
+                
+                text_lines = ocr_result.text_lines
+                line_bboxes = np.array([line.bbox for line in text_lines], dtype=np.float64).reshape(-1, 4)
                 
-                # Sort text lines by reading order
+                # Sort text lines by reading order, as (order index, line index) pairs
                 ordered_lines = []
                 if order_result and hasattr(order_result, 'bboxes'):
-                    for i, bbox in enumerate(order_result.bboxes):
-                        # Find corresponding OCR text
-                        for text_line in ocr_result.text_lines:
-                            if self._bbox_overlap(bbox, text_line.bbox):
-                                ordered_lines.append((i, text_line))
-                                break
+                    order_bboxes = np.array(order_result.bboxes, dtype=np.float64).reshape(-1, 4)
+                    if len(order_bboxes) and len(line_bboxes):
+                        # Each reading-order box takes the first OCR line it overlaps
+                        overlaps = self._bbox_overlap_matrix(order_bboxes, line_bboxes)
+                        first_line = overlaps.argmax(axis=1)
+                        ordered_lines = [(i, int(first_line[i])) for i in np.flatnonzero(overlaps.any(axis=1))]
                 else:
                     # Fallback: sort by y-position
-                    ordered_lines = [(i, line) for i, line in enumerate(ocr_result.text_lines)]
-                    ordered_lines.sort(key=lambda x: x[1].bbox[1])  # Sort by y-coordinate
+                    ordered_lines = [(i, i) for i in sorted(range(len(text_lines)), key=lambda i: text_lines[i].bbox[1])]
+                
+                # Determine element types from layout detection for the whole page at once
+                line_types = self._classify_from_layout(line_bboxes, layout_result)
                 
                 # Process ordered text lines
-                for order_idx, text_line in ordered_lines:
-                    if text_line.text.strip():
-                        # Determine element type from layout detection
-                        element_type = self._classify_from_layout(text_line.bbox, layout_result)
-                        
-                        elements.append({
-                            "id": f"page_{page_num}_line_{order_idx}",
-                            "type": element_type,
-                            "content": text_line.text.strip(),
-                            "bbox": {
-                                "x1": text_line.bbox[0],
-                                "y1": text_line.bbox[1],
-                                "x2": text_line.bbox[2],
-                                "y2": text_line.bbox[3],
-                                "page": page_num
-                            },
-                            "confidence": getattr(text_line, 'confidence', 0.90),
-                            "language": getattr(text_line, 'language', 'unknown')
-                        })
-                        
-                        # Add to markdown with appropriate formatting
-                        if element_type == "title":
-                            page_content += f"# {text_line.text.strip()}\n\n"
-                        elif element_type == "header":
-                            page_content += f"## {text_line.text.strip()}\n\n"
-                        elif element_type == "list":
-                            page_content += f"- {text_line.text.strip()}\n"
-                        else:
-                            page_content += f"{text_line.text.strip()}\n\n"
+                for order_idx, line_idx in ordered_lines:
+                    text_line = text_lines[line_idx]
+                    # Strip once and unpack the box once; both are reused below
+                    text = text_line.text.strip()
+                    if not text:
+                        continue
+                    x1, y1, x2, y2 = text_line.bbox
+                    element_type = line_types[line_idx]
+                    
+                    elements.append({
+                        "id": f"page_{page_num}_line_{order_idx}",
+                        "type": element_type,
+                        "content": text,
+                        "bbox": {
+                            "x1": x1 * scale,
+                            "y1": y1 * scale,
+                            "x2": x2 * scale,
+                            "y2": y2 * scale,
+                            "page": page_num
+                        },
+                        "confidence": getattr(text_line, 'confidence', 0.90),
+                        "language": getattr(text_line, 'language', 'unknown')
+                    })
+                    
+                    # Add to markdown with appropriate formatting
+                    if element_type == "title":
+                        page_parts.append(f"# {text}\n\n")
+                    elif element_type == "header":
+                        page_parts.append(f"## {text}\n\n")
+                    elif element_type == "list":
+                        page_parts.append(f"- {text}\n")
+                    else:
+                        page_parts.append(f"{text}\n\n")
                 
                 # Process layout elements (tables, figures, etc.)
                 if layout_result and hasattr(layout_result, 'bboxes'):
@@ -152,10 +427,10 @@ class SuryaPipeline:
                                 "type": element_type,
                                 "content": f"[{label} detected at layout analysis]",
                                 "bbox": {
-                                    "x1": bbox[0],
-                                    "y1": bbox[1],
-                                    "x2": bbox[2],
-                                    "y2": bbox[3],
+                                    "x1": bbox[0] * scale,
+                                    "y1": bbox[1] * scale,
+                                    "x2": bbox[2] * scale,
+                                    "y2": bbox[3] * scale,
                                     "page": page_num
                                 },
                                 "confidence": 0.85,
@@ -163,21 +438,30 @@ class SuryaPipeline:
                                 "layout_type": label
                             })
                 
-                markdown_content += page_content
+                markdown_parts.append("".join(page_parts))
+            
+            # Tally types, confidence and languages in one pass
+            type_counts = Counter()
+            confidence_sum = 0.0
+            languages_detected = set()
+            for element in elements:
+                type_counts[element["type"]] += 1
+                confidence_sum += element["confidence"]
+                languages_detected.add(element.get("language", "unknown"))
             
             # Generate metadata
             metadata = {
-                "total_pages": len(images),
+                "total_pages": page_count,
                 "total_elements": len(elements),
-                "by_type": self._count_by_type(elements),
-                "confidence_avg": sum(e["confidence"] for e in elements) / len(elements) if elements else 0.90,
-                "languages_detected": list(set(e.get("language", "unknown") for e in elements)),
+                "by_type": dict(type_counts),
+                "confidence_avg": confidence_sum / len(elements) if elements else 0.90,
+                "languages_detected": list(languages_detected),
                 "features_detected": ["ocr", "layout", "multilingual", "reading_order"],
                 "model_version": "surya_v1.0"
             }
             
             return {
-                "markdown": markdown_content,
+                "markdown": "".join(markdown_parts),
                 "elements": elements,
                 "metadata": metadata,
                 "success": True
@@ -188,41 +472,232 @@ class SuryaPipeline:
             # Fallback to PyMuPDF
             return await self._fallback_extraction(file_path, options)
     
-    def _bbox_overlap(self, bbox1, bbox2) -> bool:
-        """Check if two bounding boxes overlap"""
-        return not (bbox1[2] < bbox2[0] or bbox2[2] < bbox1[0] or bbox1[3] < bbox2[1] or bbox2[3] < bbox1[1])
+    def _run_models(self, images: List[Image.Image], languages: List[str]) -> Tuple[List[Any], List[Any], List[Any]]:
+        """Run layout detection, OCR and reading order over one batch of page images (blocking)"""
+        # inference_mode is per-thread, so it is entered here on the model thread
+        with self.inference_mode():
+            # Run layout detection
+            layout_results = self.batch_layout_detection(images, self.det_model, self.det_processor)
+            
+            # Run OCR on detected regions
+            ocr_results = self.run_ocr(images, [languages] * len(images), self.det_model, self.det_processor, self.rec_model, self.rec_processor)
+            
+            # Run reading order detection
+            order_results = self.batch_ordering(images, layout_results, self.order_model, self.order_processor)
+        return layout_results, ocr_results, order_results
+    
+    async def _iter_page_batches(self, file_path: str, page_count: int) -> AsyncIterator[Tuple[List[Image.Image], List[float], List[Tuple[int, int, bytes]]]]:
+        """Yield (images, bbox_scales, page_keys) for each ocr_batch_size group of pages, in page order"""
+        # Pages rasterize at higher DPI for better OCR, in parallel in the shared
+        # process pool. The next batch is queued before the current one is handed
+        # to the models, so CPU rendering of batch N+1 overlaps GPU work on batch N
+        # while at most two batches of pages are held at once. Rendering holds the
+        # GIL, so pages are spread across processes, each opening its own document
+        loop = asyncio.get_running_loop()
+        pool = get_page_pool()
+        pending = self._submit_render_batch(loop, pool, file_path, 0, page_count)
+        try:
+            for start in range(0, page_count, self.ocr_batch_size):
+                # gather() keeps pages in page order
+                rendered_pages = await asyncio.gather(*pending)
+                # Past the last page this queues nothing
+                pending = self._submit_render_batch(loop, pool, file_path, start + self.ocr_batch_size, page_count)
+                
+                images = [
+                    Image.frombuffer("RGB", (width, height), samples, "raw", "RGB", 0, 1)
+                    for _, width, height, samples, _ in rendered_pages
+                ]
+                # Pages with the same size and pixels get the same key
+                yield (
+                    images,
+                    [RENDER_ZOOM / zoom for zoom, _, _, _, _ in rendered_pages],
+                    [(width, height, digest) for _, width, height, _, digest in rendered_pages],
+                )
+        finally:
+            # The consumer stopped early or a page failed: drop renders not yet started
+            for future in pending:
+                future.cancel()
+    
+    def _submit_render_batch(self, loop, pool: ProcessPoolExecutor, file_path: str, start: int, page_count: int) -> List[asyncio.Future]:
+        """Queue renders for the ocr_batch_size pages starting at start"""
+        return [
+            loop.run_in_executor(pool, _render_page, file_path, page_num)
+            for page_num in range(start, min(start + self.ocr_batch_size, page_count))
+        ]
     
-    def _classify_from_layout(self, bbox, layout_result) -> str:
-        """Classify element type based on layout detection"""
-        if not layout_result or not hasattr(layout_result, 'bboxes'):
-            return "text"
+    def _has_text_layer(self, file_path: str) -> bool:
+        """Check whether the first few pages carry enough embedded text to skip OCR"""
+        doc = fitz.open(file_path)
+        try:
+            sample_pages = range(min(TEXT_PROBE_PAGES, len(doc)))
+            return sum(len(doc[page_num].get_text().strip()) for page_num in sample_pages) > TEXT_PROBE_MIN_CHARS
+        finally:
+            doc.close()
+    
+    def _page_count(self, file_path: str) -> int:
+        """Get the number of pages in a PDF"""
+        doc = fitz.open(file_path)
+        try:
+            return len(doc)
+        finally:
+            doc.close()
+    
+    def _bbox_overlap_matrix(self, bboxes1: np.ndarray, bboxes2: np.ndarray) -> np.ndarray:
+        """Check every pair of (x1, y1, x2, y2) boxes for overlap; returns a (len(bboxes1), len(bboxes2)) bool matrix"""
+        a = bboxes1[:, None, :]
+        b = bboxes2[None, :, :]
+        return ~((a[..., 2] < b[..., 0]) | (b[..., 2] < a[..., 0]) | (a[..., 3] < b[..., 1]) | (b[..., 3] < a[..., 1]))
+    
+    def _layout_category(self, label: str) -> Optional[str]:
+        """Map a layout label to an element type, or None if it doesn't decide one (memoized per label)"""
+        if label in _layout_category_cache:
+            return _layout_category_cache[label]
         
-        # Find overlapping layout regions
-        for layout_bbox, label in zip(layout_result.bboxes, layout_result.labels):
-            if self._bbox_overlap(bbox, layout_bbox):
-                label_lower = label.lower()
-                if 'title' in label_lower or 'heading' in label_lower:
-                    return 'title'
-                elif 'header' in label_lower:
-                    return 'header'
-                elif 'table' in label_lower:
-                    return 'table'
-                elif 'list' in label_lower:
-                    return 'list'
-                elif 'figure' in label_lower or 'image' in label_lower:
-                    return 'image'
+        category = self._layout_category_for_label(label.lower())
+        _layout_category_cache[label] = category
+        return category
+    
+    def _layout_category_for_label(self, label_lower: str) -> Optional[str]:
+        """Match a lowercased layout label against the element type fragments"""
+        if 'title' in label_lower or 'heading' in label_lower:
+            return 'title'
+        elif 'header' in label_lower:
+            return 'header'
+        elif 'table' in label_lower:
+            return 'table'
+        elif 'list' in label_lower:
+            return 'list'
+        elif 'figure' in label_lower or 'image' in label_lower:
+            return 'image'
+        return None
+    
+    def _build_layout_index(self, layout_result) -> Tuple[np.ndarray, List[str]]:
+        """Stack the bboxes of a page's type-deciding layout regions, in detection order, with their types"""
+        bboxes = []
+        categories = []
+        for bbox, label in zip(layout_result.bboxes, layout_result.labels):
+            category = self._layout_category(label)
+            if category is not None:
+                bboxes.append(bbox)
+                categories.append(category)
+        return np.array(bboxes, dtype=np.float64).reshape(-1, 4), categories
+    
+    def _classify_from_layout(self, line_bboxes: np.ndarray, layout_result) -> List[str]:
+        """Classify each text line by the first overlapping layout region with a recognised label"""
+        if not layout_result or not hasattr(layout_result, 'bboxes') or not len(line_bboxes):
+            return ["text"] * len(line_bboxes)
         
-        return "text"
+        layout_bboxes, categories = self._build_layout_index(layout_result)
+        if not categories:
+            return ["text"] * len(line_bboxes)
+        
+        # Lines take the first overlapping region that decides a type
+        overlaps = self._bbox_overlap_matrix(line_bboxes, layout_bboxes)
+        first_region = overlaps.argmax(axis=1)
+        return [categories[first_region[i]] if hit else "text" for i, hit in enumerate(overlaps.any(axis=1))]
+    
+    def _append_text_blocks(self, page, page_num: int, elements: List[Dict[str, Any]], page_parts: List[str],
+                            confidence: float, language: str):
+        """Append a page's text blocks as elements and markdown"""
+        # The flat "blocks" output has each block's text joined in C, so no per-span
+        # dicts are built. Image blocks are kept (as short descriptions, not bytes) so
+        # block numbers, and the element ids built from them, match the full page structure
+        blocks = page.get_text("blocks", flags=fitz.TEXTFLAGS_TEXT | fitz.TEXT_PRESERVE_IMAGES)
+        for x0, y0, x1, y1, block_text, block_no, block_type in blocks:
+            if block_type != 0:  # not a text block
+                continue
+            
+            # MuPDF ends each line with a newline; the lines are run together as before,
+            # and the result is stripped once for both the element and the markdown
+            block_text = block_text.replace("\n", "").strip()
+            
+            if block_text:
+                elements.append({
+                    "id": f"page_{page_num}_block_{block_no}",
+                    "type": "text",
+                    "content": block_text,
+                    "bbox": {
+                        "x1": x0,
+                        "y1": y0,
+                        "x2": x1,
+                        "y2": y1,
+                        "page": page_num
+                    },
+                    "confidence": confidence,
+                    "language": language
+                })
+                
+                page_parts.append(f"{block_text}\n\n")
+    
+    def _extract_page_images(self, doc, page, page_num: int, xref_cache: Dict[int, Optional[Tuple[int, int, str, int]]],
+                             elements: List[Dict], page_parts: List[str]):
+        """Append a page's image elements and markdown; a broken image raises after earlier images were added"""
+        image_list = page.get_images(full=True)
+        for img_idx, img in enumerate(image_list):
+            # Get image info (decoded once per xref, however many pages reuse it)
+            xref = img[0]
+            image_info = self._image_info(doc, xref, xref_cache)
+            
+            # Skip very small images (likely decorative)
+            if image_info is None:
+                continue
+            width, height, colorspace, size_bytes = image_info
+            
+            # Get image bbox - estimate from page content if not available
+            img_bbox = self._estimate_image_bbox(page, width, height)
+            
+            # Create image element
+            image_element = {
+                "id": f"page_{page_num}_image_{img_idx}",
+                "type": "image",
+                "content": f"[Image: {width}x{height} pixels]",
+                "bbox": {
+                    "x1": img_bbox[0],
+                    "y1": img_bbox[1],
+                    "x2": img_bbox[2],
+                    "y2": img_bbox[3],
+                    "page": page_num
+                },
+                "confidence": 0.85,
+                "language": "image",
+                "image_info": {
+                    "width": width,
+                    "height": height,
+                    "colorspace": colorspace,
+                    "xref": xref,
+                    "size_bytes": size_bytes
+                }
+            }
+            
+            elements.append(image_element)
+            
+            # Add image to markdown
+            page_parts.append(f"\n![Image {img_idx + 1}](image_{page_num}_{img_idx}.png)\n")
+            page_parts.append(f"*Image: {width}x{height} pixels*\n\n")
     
-    def _count_by_type(self, elements: List[Dict]) -> Dict[str, int]:
-        """Count elements by type"""
-        counts = {}
-        for element in elements:
-            element_type = element["type"]
-            counts[element_type] = counts.get(element_type, 0) + 1
-        return counts
+    def _image_info(self, doc, xref: int, xref_cache: Dict[int, Optional[Tuple[int, int, str, int]]]) -> Optional[Tuple[int, int, str, int]]:
+        """Get (width, height, colorspace, size_bytes) for an image xref, or None if it is too small to report"""
+        if xref in xref_cache:
+            return xref_cache[xref]
+        
+        pix_img = fitz.Pixmap(doc, xref)
+        if pix_img.width < 50 or pix_img.height < 50:
+            image_info = None
+        else:
+            image_info = (
+                pix_img.width,
+                pix_img.height,
+                pix_img.colorspace.name if pix_img.colorspace else "Unknown",
+                len(pix_img.tobytes()),
+            )
+        
+        # Clean up pixmap
+        pix_img = None
+        
+        xref_cache[xref] = image_info
+        return image_info
     
-    def _estimate_image_bbox(self, page, xref: int, pix) -> List[float]:
+    def _estimate_image_bbox(self, page, img_width: float, img_height: float) -> List[float]:
         """Estimate image bounding box on the page"""
         try:
             # Try to get the actual image rect from page
@@ -233,8 +708,8 @@ class SuryaPipeline:
             page_height = page_rect.height
             
             # Estimate position - center the image with reasonable margins
-            img_width = min(pix.width, page_width * 0.8)  # Don't exceed 80% of page width
-            img_height = min(pix.height, page_height * 0.6)  # Don't exceed 60% of page height
+            img_width = min(img_width, page_width * 0.8)  # Don't exceed 80% of page width
+            img_height = min(img_height, page_height * 0.6)  # Don't exceed 60% of page height
             
             # Center horizontally, place in middle/lower section vertically
             x1 = (page_width - img_width) / 2
@@ -252,210 +727,35 @@ class SuryaPipeline:
     async def _fallback_extraction(self, file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
         """Fallback extraction using PyMuPDF with OCR-like processing"""
         try:
-            doc = fitz.open(file_path)
+            page_count = await asyncio.to_thread(self._page_count, file_path)
             
-            markdown_content = ""
-            elements = []
+            # Pages are independent: give each worker in the shared process pool one
+            # contiguous page range. Ranges rather than single pages keep the xref
+            # cache effective for images repeated across pages; gather() keeps order.
+            workers = max(1, min(page_count, PAGE_POOL_WORKERS))
+            range_size = -(-page_count // workers)
+            loop = asyncio.get_running_loop()
+            pool = get_page_pool()
+            range_results = await asyncio.gather(*(
+                loop.run_in_executor(pool, _extract_page_range_worker, file_path, start, min(start + range_size, page_count))
+                for start in range(0, page_count, max(1, range_size))
+            ))
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                
-                # Try to extract text normally first
-                page_text = page.get_text()
-                
-                if len(page_text.strip()) < 50:  # Likely scanned document
-                    # Convert to image and do basic OCR simulation
-                    mat = fitz.Matrix(2.0, 2.0)
-                    pix = page.get_pixmap(matrix=mat)
-                    
-                    # Fallback: extract text blocks with position info
-                    blocks = page.get_text("dict")
-                    page_content = f"\n\n## Page {page_num + 1}\n\n"
-                    
-                    if blocks and blocks.get("blocks"):
-                        for block_idx, block in enumerate(blocks["blocks"]):
-                            if "lines" not in block:
-                                continue
-                            
-                            block_text = ""
-                            for line in block["lines"]:
-                                for span in line["spans"]:
-                                    block_text += span["text"]
-                            
-                            if block_text.strip():
-                                elements.append({
-                                    "id": f"page_{page_num}_block_{block_idx}",
-                                    "type": "text",
-                                    "content": block_text.strip(),
-                                    "bbox": {
-                                        "x1": block["bbox"][0],
-                                        "y1": block["bbox"][1],
-                                        "x2": block["bbox"][2],
-                                        "y2": block["bbox"][3],
-                                        "page": page_num
-                                    },
-                                    "confidence": 0.75,  # Lower confidence for fallback
-                                    "language": "unknown"
-                                })
-                                
-                                page_content += f"{block_text.strip()}\n\n"
-                    
-                    # Extract images from the page
-                    try:
-                        image_list = page.get_images(full=True)
-                        for img_idx, img in enumerate(image_list):
-                            # Get image info
-                            xref = img[0]
-                            pix_img = fitz.Pixmap(doc, xref)
-                            
-                            # Skip very small images (likely decorative)
-                            if pix_img.width < 50 or pix_img.height < 50:
-                                pix_img = None
-                                continue
-                            
-                            # Get image bbox - estimate from page content if not available
-                            img_bbox = self._estimate_image_bbox(page, xref, pix_img)
-                            
-                            # Create image element
-                            image_element = {
-                                "id": f"page_{page_num}_image_{img_idx}",
-                                "type": "image",
-                                "content": f"[Image: {pix_img.width}x{pix_img.height} pixels]",
-                                "bbox": {
-                                    "x1": img_bbox[0],
-                                    "y1": img_bbox[1],
-                                    "x2": img_bbox[2],
-                                    "y2": img_bbox[3],
-                                    "page": page_num
-                                },
-                                "confidence": 0.85,
-                                "language": "image",
-                                "image_info": {
-                                    "width": pix_img.width,
-                                    "height": pix_img.height,
-                                    "colorspace": pix_img.colorspace.name if pix_img.colorspace else "Unknown",
-                                    "xref": xref,
-                                    "size_bytes": len(pix_img.tobytes())
-                                }
-                            }
-                            
-                            elements.append(image_element)
-                            
-                            # Add image to markdown
-                            page_content += f"\n![Image {img_idx + 1}](image_{page_num}_{img_idx}.png)\n"
-                            page_content += f"*Image: {pix_img.width}x{pix_img.height} pixels*\n\n"
-                            
-                            # Clean up pixmap
-                            pix_img = None
-                            
-                    except Exception as e:
-                        logger.warning(f"Image extraction failed for page {page_num}: {e}")
-                        pass
-                    
-                    else:
-                        # Very basic fallback
-                        page_content += f"[Scanned page - OCR needed]\n\n"
-                        elements.append({
-                            "id": f"page_{page_num}_scanned",
-                            "type": "text",
-                            "content": "[Scanned content detected - OCR processing recommended]",
-                            "bbox": {"x1": 0, "y1": 0, "x2": 612, "y2": 792, "page": page_num},
-                            "confidence": 0.50,
-                            "language": "unknown"
-                        })
-                else:
-                    # Regular text extraction
-                    blocks = page.get_text("dict")
-                    page_content = f"\n\n## Page {page_num + 1}\n\n"
-                    
-                    for block_idx, block in enumerate(blocks["blocks"]):
-                        if "lines" not in block:
-                            continue
-                        
-                        block_text = ""
-                        for line in block["lines"]:
-                            for span in line["spans"]:
-                                block_text += span["text"]
-                        
-                        if block_text.strip():
-                            elements.append({
-                                "id": f"page_{page_num}_block_{block_idx}",
-                                "type": "text",
-                                "content": block_text.strip(),
-                                "bbox": {
-                                    "x1": block["bbox"][0],
-                                    "y1": block["bbox"][1],
-                                    "x2": block["bbox"][2],
-                                    "y2": block["bbox"][3],
-                                    "page": page_num
-                                },
-                                "confidence": 0.80,
-                                "language": "en"  # Default assumption
-                            })
-                            
-                            page_content += f"{block_text.strip()}\n\n"
-                    
-                    # Extract images from the page (for regular text extraction)
-                    try:
-                        image_list = page.get_images(full=True)
-                        for img_idx, img in enumerate(image_list):
-                            # Get image info
-                            xref = img[0]
-                            pix_img = fitz.Pixmap(doc, xref)
-                            
-                            # Skip very small images (likely decorative)
-                            if pix_img.width < 50 or pix_img.height < 50:
-                                pix_img = None
-                                continue
-                            
-                            # Get image bbox - estimate from page content if not available
-                            img_bbox = self._estimate_image_bbox(page, xref, pix_img)
-                            
-                            # Create image element
-                            image_element = {
-                                "id": f"page_{page_num}_image_{img_idx}",
-                                "type": "image",
-                                "content": f"[Image: {pix_img.width}x{pix_img.height} pixels]",
-                                "bbox": {
-                                    "x1": img_bbox[0],
-                                    "y1": img_bbox[1],
-                                    "x2": img_bbox[2],
-                                    "y2": img_bbox[3],
-                                    "page": page_num
-                                },
-                                "confidence": 0.85,
-                                "language": "image",
-                                "image_info": {
-                                    "width": pix_img.width,
-                                    "height": pix_img.height,
-                                    "colorspace": pix_img.colorspace.name if pix_img.colorspace else "Unknown",
-                                    "xref": xref,
-                                    "size_bytes": len(pix_img.tobytes())
-                                }
-                            }
-                            
-                            elements.append(image_element)
-                            
-                            # Add image to markdown
-                            page_content += f"\n![Image {img_idx + 1}](image_{page_num}_{img_idx}.png)\n"
-                            page_content += f"*Image: {pix_img.width}x{pix_img.height} pixels*\n\n"
-                            
-                            # Clean up pixmap
-                            pix_img = None
-                            
-                    except Exception as e:
-                        logger.warning(f"Image extraction failed for page {page_num}: {e}")
-                        pass
-                
-                markdown_content += page_content
+            markdown_content = "".join(range_markdown for range_markdown, _ in range_results)
+            elements = [element for _, range_elements in range_results for element in range_elements]
             
-            doc.close()
+            # Tally types and confidence in one pass
+            type_counts = Counter()
+            confidence_sum = 0.0
+            for element in elements:
+                type_counts[element["type"]] += 1
+                confidence_sum += element["confidence"]
             
             metadata = {
-                "total_pages": len(doc),
+                "total_pages": page_count,
                 "total_elements": len(elements),
-                "by_type": self._count_by_type(elements),
-                "confidence_avg": sum(e["confidence"] for e in elements) / len(elements) if elements else 0.75,
+                "by_type": dict(type_counts),
+                "confidence_avg": confidence_sum / len(elements) if elements else 0.75,
                 "languages_detected": ["en"],  # Default
                 "features_detected": ["text", "basic_ocr"],
                 "model_version": "pymupdf_ocr_fallback_v1.0"
@@ -470,19 +770,74 @@ class SuryaPipeline:
             
         except Exception as e:
             logger.error(f"Fallback OCR extraction failed: {e}")
-            return {
-                "markdown": "",
-                "elements": [],
-                "metadata": {"total_pages": 0, "total_elements": 0, "by_type": {}, "confidence_avg": 0},
-                "success": False,
-                "error": str(e)
-            }
-
+            return self._failed_result(e)
+    
+    def _failed_result(self, error: Exception) -> Dict[str, Any]:
+        """Result returned when a PDF can't be extracted at all"""
+        return {
+            "markdown": "",
+            "elements": [],
+            "metadata": {"total_pages": 0, "total_elements": 0, "by_type": {}, "confidence_avg": 0},
+            "success": False,
+            "error": str(error)
+        }
+    
+    def _extract_page_range(self, file_path: str, start: int, end: int) -> Tuple[str, List[Dict[str, Any]]]:
+        """Extract markdown and elements for pages [start, end); opens its own document so ranges can run in parallel"""
+        doc = fitz.open(file_path)
+        try:
+            # Markdown pieces for the range, joined once at the end
+            markdown_parts = []
+            elements = []
+            # Image details per xref; logos and headers repeat the same image on many pages
+            xref_cache = {}
+            
+            for page_num in range(start, end):
+                page = doc[page_num]
+                
+                # Pages with almost no embedded text are likely scanned; their blocks get
+                # lower confidence and the page is flagged for OCR
+                scanned = len(page.get_text().strip()) < 50
+                page_parts = [f"\n\n## Page {page_num + 1}\n\n"]
+                
+                if scanned:
+                    self._append_text_blocks(page, page_num, elements, page_parts, confidence=0.75, language="unknown")
+                else:
+                    self._append_text_blocks(page, page_num, elements, page_parts, confidence=0.80, language="en")
+                
+                # Extract images from the page
+                try:
+                    self._extract_page_images(doc, page, page_num, xref_cache, elements, page_parts)
+                except Exception as e:
+                    logger.warning(f"Image extraction failed for page {page_num}: {e}")
+                else:
+                    if scanned:
+                        # Very basic fallback
+                        page_parts.append(f"[Scanned page - OCR needed]\n\n")
+                        elements.append({
+                            "id": f"page_{page_num}_scanned",
+                            "type": "text",
+                            "content": "[Scanned content detected - OCR processing recommended]",
+                            "bbox": {"x1": 0, "y1": 0, "x2": 612, "y2": 792, "page": page_num},
+                            "confidence": 0.50,
+                            "language": "unknown"
+                        })
+                
+                markdown_parts.append("".join(page_parts))
+            
+            return "".join(markdown_parts), elements
+        finally:
+            doc.close()
 
 # Global instance
 surya_pipeline = SuryaPipeline()
 
 
+def _extract_page_range_worker(file_path: str, start: int, end: int) -> Tuple[str, List[Dict[str, Any]]]:
+    """Process-pool entry point for fallback page extraction (module-level so it pickles)"""
+    return surya_pipeline._extract_page_range(file_path, start, end)
+
+
 async def process_with_surya(file_path: str, options: Dict[str, Any] = None) -> Dict[str, Any]:
     """Process PDF with Surya OCR pipeline"""
     return await surya_pipeline.extract(file_path, options)
\ No newline at end of file